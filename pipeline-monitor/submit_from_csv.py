@@ -4,6 +4,7 @@ Submit image analyses periodically using pipeline-monitor.py:submit_analysis.
 
 Usage (from repo root):
     python pipeline-monitor/submit_from_csv.py path/to/jobs.csv [--interval-minutes N]
+    python pipeline-monitor/submit_from_csv.py path/to/jobs.csv --max-active N [--max-per-hour N] [--concurrency N]
 
 The CSV file must have a header row with at least:
     plate_acquisition,analysis_pipeline_name,cellprofiler_version
@@ -14,20 +15,40 @@ Optional columns (will default if missing/empty):
     run_location,submitted_by
 
 Every xx minutes the next row is submitted via submit_analysis.
+
+Submitted rows are recorded in a checkpoint file next to the CSV (<csv>.state.jsonl, see
+--state-file), a restarted run skips them and continues with the next row. Rows are matched by
+their content, so rows can be appended to (or reordered in) the CSV between runs, an edited row
+counts as a new row. --dry-run only
+validates every row and reports what would be submitted.
+
+A row with an identical analysis (same plate acquisition, pipeline, cellprofiler version and
+filters) that is queued, running or finished in the database is skipped, unless --allow-duplicates.
+
+With --max-active the rows are instead submitted whenever the number of queued and running
+sub analyses in the database is below the high-water mark, at most --max-per-hour rows per
+hour and --concurrency submissions at the same time.
 """
 
 import csv
+import hashlib
+import json
 import logging
+import os
 import sys
 import time
+import threading
 import argparse
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
-from pipeline_monitor import submit_analysis
+from pipeline_monitor import submit_analysis, get_connection, put_connection
 
 
 INTERVAL_SECONDS = 240 * 60  # default: 240 minutes (4 hours)
+POLL_SECONDS = 60  # scheduler mode: seconds between checks of the cluster load
 
 
 def _to_bool(value: Optional[str]) -> bool:
@@ -37,89 +58,411 @@ def _to_bool(value: Optional[str]) -> bool:
     return v in {"1", "true", "yes", "y", "on"}
 
 
-def read_jobs(csv_path: Path) -> List[Dict[str, Any]]:
+# (row number, row key, row) of a CSV row, see read_jobs
+Job = Tuple[int, str, Dict[str, Any]]
+
+
+def read_jobs(csv_path: Path) -> Iterator[Job]:
+    """
+    Rows of the CSV with their row number (1 = first row after the header) and key, read one at a time.
+
+    The key is the sha256 of the row content and the number of identical rows before it, so it
+    stays the same when rows are added or moved and two identical rows are still two rows.
+    """
     with csv_path.open(newline="") as f:
         reader = csv.DictReader(f)
-        jobs: List[Dict[str, Any]] = []
+        row_no = 0
+        seen: Dict[str, int] = {}
         for row in reader:
             if not row:
                 continue
-            jobs.append(row)
-    return jobs
-
+            row_no += 1
+            content = json.dumps(sorted((k, (v or "").strip()) for k, v in row.items() if k is not None))
+            digest = hashlib.sha256(content.encode()).hexdigest()
+            occurrence = seen.get(digest, 0)
+            seen[digest] = occurrence + 1
+            yield row_no, f"{digest}-{occurrence}", row
+
+
+class Checkpoint:
+    """
+    Append-only JSON lines file with the submission state of CSV rows, keyed by the row key (see
+    read_jobs). A row is written as "submitting" before submit_analysis is called and as
+    "submitted" with its result (the analysis ids) or "failed" after, every line is flushed and
+    fsynced before the tool goes on. Rows skipped as duplicates are "skipped" with the id of the
+    existing analysis.
+
+    A crash while writing can leave a partial last line, it is dropped (and cut from the file, so
+    the next record starts on its own line) and the row is submitted again.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.rows: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+        if path.exists():
+            self._load()
+
+        # opened on the first mark, a dry run does not create the file
+        self._file = None
+
+    def _load(self) -> None:
+        with self.path.open("rb") as f:
+            data = f.read()
+
+        offset = 0
+        lines = data.split(b"\n")
+        for line_no, line in enumerate(lines, 1):
+            line_end = offset + len(line) + 1
+            is_last = line_no == len(lines) or (line_no == len(lines) - 1 and not lines[-1])
+            if line.strip():
+                try:
+                    record = json.loads(line)
+                    self.rows[record["row_key"]] = record
+                except (ValueError, KeyError, TypeError):
+                    if is_last:
+                        logging.warning("Dropping incomplete last record of %s: %r", self.path, line[:200])
+                        with self.path.open("r+b") as f:
+                            f.truncate(offset)
+                        break
+                    logging.warning("Ignoring malformed record on line %s of %s", line_no, self.path)
+            offset = line_end
+
+    def status(self, row_key: str) -> Optional[str]:
+        record = self.rows.get(row_key)
+        return record["status"] if record else None
+
+    def mark(self, row_key: str, row_no: int, status: str, result: Any = None) -> None:
+        record = {"row_key": row_key, "row": row_no, "status": status,
+                  "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "result": result}
+        with self._lock:
+            if self._file is None:
+                self._file = self.path.open("a")
+            self._file.write(json.dumps(record, default=str) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.rows[row_key] = record
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+
+
+def pending_jobs(jobs: Iterable[Job], checkpoint: Optional[Checkpoint]) -> Iterator[Job]:
+    """
+    The rows that are not submitted according to the checkpoint
+    """
+    for row_no, row_key, job in jobs:
+        status = checkpoint.status(row_key) if checkpoint else None
+        if status in ("submitted", "skipped"):
+            logging.debug("Row %s already %s, skipping", row_no, status)
+            continue
+        if status == "submitting":
+            # the tool stopped during submit_analysis, the row may or may not be in the database
+            logging.warning("Row %s was being submitted when the tool stopped, skipping it. "
+                            "Check image_analyses and remove the records of row_key %s from %s to submit it again",
+                            row_no, row_key, checkpoint.path)
+            continue
+        yield row_no, row_key, job
+
+
+# Same key as dbqueries.SUBMIT_ANALYSES_LOCK_KEY in the webserver, so the CSV tool and the webserver
+# do not insert identical analyses at the same time
+SUBMIT_ANALYSES_LOCK_KEY = 7208141
+
+
+def find_duplicate_analysis(cursor: Any, args: Dict[str, Any]) -> Optional[int]:
+    """
+    Id of an analysis (queued, running or finished) identical to the submission of args, one lookup
+    in the fingerprint index of image_analyses (webserver/sql/003_submission_fingerprint.sql).
+    The analysis_meta keys are the ones submit_analysis sets and the fingerprint covers.
+    """
+    analysis_meta: Dict[str, Any] = {"cp_version": args["cellprofiler_version"]}
+    if args["well_filter"]:
+        analysis_meta["well_filter"] = args["well_filter"].split(",")
+    if args["site_filter"]:
+        analysis_meta["site_filter"] = args["site_filter"].split(",")
+    if args["z_plane"]:
+        analysis_meta["z"] = args["z_plane"]
+
+    cursor.execute(
+        "SELECT min(id) FROM image_analyses "
+        "WHERE submission_fingerprint = submission_fingerprint(%s, %s, %s::jsonb) AND error IS NULL",
+        (args["plate_acquisition"], args["analysis_pipeline_name"], json.dumps(analysis_meta)),
+    )
+    return cursor.fetchone()[0]
+
+
+def submit_row(row_no: int, row_key: str, args: Dict[str, Any], checkpoint: Optional[Checkpoint],
+               allow_duplicates: bool = False) -> str:
+    """
+    Submit a row and record it in the checkpoint, returns "submitted" or "skipped" (duplicate).
+
+    Unless allow_duplicates, a session advisory lock is held across the duplicate lookup and
+    submit_analysis (which inserts on its own connection), so rows in flight at the same time and
+    submissions from the webserver can not both pass the lookup.
+    """
+    if allow_duplicates:
+        return _submit_and_mark(row_no, row_key, args, checkpoint)
+
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_lock(%s)", (SUBMIT_ANALYSES_LOCK_KEY,))
+            try:
+                duplicate_of = find_duplicate_analysis(cursor, args)
+                # end the lookup transaction, the session lock stays until unlocked
+                conn.commit()
+                if duplicate_of is not None:
+                    logging.warning("Skipping row %s, plate_acquisition %s is identical to analysis %s",
+                                    row_no, args["plate_acquisition"], duplicate_of)
+                    if checkpoint:
+                        checkpoint.mark(row_key, row_no, "skipped", {"duplicate_of": duplicate_of})
+                    return "skipped"
+                return _submit_and_mark(row_no, row_key, args, checkpoint)
+            finally:
+                conn.rollback()
+                cursor.execute("SELECT pg_advisory_unlock(%s)", (SUBMIT_ANALYSES_LOCK_KEY,))
+                conn.commit()
+    finally:
+        put_connection(conn)
+
+
+def _submit_and_mark(row_no: int, row_key: str, args: Dict[str, Any], checkpoint: Optional[Checkpoint]) -> str:
+    if checkpoint:
+        checkpoint.mark(row_key, row_no, "submitting")
+    try:
+        result = submit_job(args)
+    except Exception as e:
+        if checkpoint:
+            checkpoint.mark(row_key, row_no, "failed", repr(e))
+        raise
+    if checkpoint:
+        checkpoint.mark(row_key, row_no, "submitted", result)
+    return "submitted"
+
+
+def dry_run(jobs: Iterable[Job], checkpoint: Optional[Checkpoint]) -> bool:
+    """
+    Validate every row and report what would be submitted, returns False if a row is invalid
+    """
+    counts = {"valid": 0, "invalid": 0, "submitted": 0, "submitting": 0, "skipped": 0}
+    for row_no, row_key, job in jobs:
+        status = checkpoint.status(row_key) if checkpoint else None
+        if status in ("submitted", "submitting", "skipped"):
+            counts[status] += 1
+        elif parse_job(row_no, job) is None:
+            counts["invalid"] += 1
+        else:
+            counts["valid"] += 1
+
+    logging.info("Dry run: %s rows to submit, %s invalid, %s already submitted, %s skipped as duplicates, "
+                 "%s with unknown outcome",
+                 counts["valid"], counts["invalid"], counts["submitted"], counts["skipped"], counts["submitting"])
+    return counts["invalid"] == 0
+
+
+def parse_job(idx: int, job: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Arguments of submit_analysis from a CSV row, None (and an error logged) if the row is invalid
+    """
+    try:
+        plate_acq = int(job.get("plate_acquisition", "").strip())
+    except ValueError:
+        logging.error("Invalid plate_acquisition in row %s: %r", idx, job.get("plate_acquisition"))
+        return None
+
+    pipeline_name = (job.get("analysis_pipeline_name") or "").strip()
+    cp_version = (job.get("cellprofiler_version") or "").strip()
+
+    if not pipeline_name or not cp_version:
+        logging.error("Missing required fields in row %s: %r", idx, job)
+        return None
+
+    return {
+        "plate_acquisition": plate_acq,
+        "analysis_pipeline_name": pipeline_name,
+        "cellprofiler_version": cp_version,
+        "well_filter": (job.get("well_filter") or "").strip(),
+        "site_filter": (job.get("site_filter") or "").strip(),
+        "z_plane": (job.get("z_plane") or "").strip(),
+        "priority_string": (job.get("priority") or "").strip(),
+        "run_on_uppmax": _to_bool(job.get("run_on_uppmax")),
+        "run_on_pharmbio": _to_bool(job.get("run_on_pharmbio")),
+        "run_on_haswell": _to_bool(job.get("run_on_haswell")),
+        "run_on_pelle": _to_bool(job.get("run_on_pelle")),
+        "run_on_hpcdev": _to_bool(job.get("run_on_hpcdev")),
+        "run_location": (job.get("run_location") or "").strip() or None,
+        "submitted_by": (job.get("submitted_by") or "").strip() or None,
+    }
+
+
+def submit_job(args: Dict[str, Any]) -> Any:
+    logging.info(
+        "Calling submit_analysis(plate_acquisition=%s, pipeline_name=%s, cellprofiler_version=%s, "
+        "well_filter=%s, site_filter=%s, z_plane=%s, priority=%s, run_on_uppmax=%s, "
+        "run_on_pharmbio=%s, run_on_haswell=%s, run_on_pelle=%s, run_on_hpcdev=%s, run_location=%s, submitted_by=%s)",
+        args["plate_acquisition"],
+        args["analysis_pipeline_name"],
+        args["cellprofiler_version"],
+        args["well_filter"],
+        args["site_filter"],
+        args["z_plane"],
+        args["priority_string"],
+        args["run_on_uppmax"],
+        args["run_on_pharmbio"],
+        args["run_on_haswell"],
+        args["run_on_pelle"],
+        args["run_on_hpcdev"],
+        args["run_location"],
+        args["submitted_by"],
+    )
 
-def submit_jobs(jobs: List[Dict[str, Any]], interval_seconds: int = INTERVAL_SECONDS) -> None:
-    for idx, job in enumerate(jobs, start=1):
-        logging.info("Submitting job %s/%s", idx, len(jobs))
+    result = submit_analysis(  # type: ignore[misc]
+        args["plate_acquisition"],
+        args["analysis_pipeline_name"],
+        args["cellprofiler_version"],
+        args["well_filter"],
+        args["site_filter"],
+        args["z_plane"],
+        args["priority_string"],
+        args["run_on_uppmax"],
+        args["run_on_pharmbio"],
+        args["run_on_haswell"],
+        args["run_on_pelle"],
+        args["run_on_hpcdev"],
+        args["run_location"],
+        submitted_by=args["submitted_by"],
+    )
 
-        try:
-            plate_acq = int(job.get("plate_acquisition", "").strip())
-        except ValueError:
-            logging.error("Invalid plate_acquisition in row %s: %r", idx, job.get("plate_acquisition"))
-            continue
+    logging.info("submit_analysis result: %r", result)
+    return result
 
-        pipeline_name = (job.get("analysis_pipeline_name") or "").strip()
-        cp_version = (job.get("cellprofiler_version") or "").strip()
 
-        if not pipeline_name or not cp_version:
-            logging.error("Missing required fields in row %s: %r", idx, job)
+def submit_jobs(jobs: Iterable[Job], interval_seconds: int = INTERVAL_SECONDS,
+                checkpoint: Optional[Checkpoint] = None, allow_duplicates: bool = False) -> None:
+    submitted_before = False
+    for row_no, row_key, job in pending_jobs(jobs, checkpoint):
+        args = parse_job(row_no, job)
+        if args is None:
             continue
 
-        well_filter = (job.get("well_filter") or "").strip()
-        site_filter = (job.get("site_filter") or "").strip()
-        z_plane = (job.get("z_plane") or "").strip()
-        priority_string = (job.get("priority") or "").strip()
-        run_on_uppmax = _to_bool(job.get("run_on_uppmax"))
-        run_on_pharmbio = _to_bool(job.get("run_on_pharmbio"))
-        run_on_haswell = _to_bool(job.get("run_on_haswell"))
-        run_on_pelle = _to_bool(job.get("run_on_pelle"))
-        run_on_hpcdev = _to_bool(job.get("run_on_hpcdev"))
-        run_location = (job.get("run_location") or "").strip() or None
-        submitted_by = (job.get("submitted_by") or "").strip() or None
-
-        logging.info(
-            "Calling submit_analysis(plate_acquisition=%s, pipeline_name=%s, cellprofiler_version=%s, "
-            "well_filter=%s, site_filter=%s, z_plane=%s, priority=%s, run_on_uppmax=%s, "
-            "run_on_pharmbio=%s, run_on_haswell=%s, run_on_pelle=%s, run_on_hpcdev=%s, run_location=%s, submitted_by=%s)",
-            plate_acq,
-            pipeline_name,
-            cp_version,
-            well_filter,
-            site_filter,
-            z_plane,
-            priority_string,
-            run_on_uppmax,
-            run_on_pharmbio,
-            run_on_haswell,
-            run_on_pelle,
-            run_on_hpcdev,
-            run_location,
-            submitted_by,
-        )
-
-        result = submit_analysis(  # type: ignore[misc]
-            plate_acq,
-            pipeline_name,
-            cp_version,
-            well_filter,
-            site_filter,
-            z_plane,
-            priority_string,
-            run_on_uppmax,
-            run_on_pharmbio,
-            run_on_haswell,
-            run_on_pelle,
-            run_on_hpcdev,
-            run_location,
-            submitted_by=submitted_by,
-        )
-
-        logging.info("submit_analysis result: %r", result)
-
-        if idx < len(jobs):
+        if submitted_before:
             logging.info("Sleeping %s seconds before next job", interval_seconds)
             time.sleep(interval_seconds)
 
+        logging.info("Submitting row %s", row_no)
+        # a skipped duplicate did not load the cluster, the next row does not have to wait for it
+        submitted_before = submit_row(row_no, row_key, args, checkpoint, allow_duplicates) == "submitted"
+
+
+def count_active_sub_analyses() -> int:
+    """
+    Number of queued and running sub analyses, the load the scheduler mode keeps below the high-water mark
+    """
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM image_sub_analyses WHERE finish IS NULL AND error IS NULL")
+            return cursor.fetchone()[0]
+    finally:
+        conn.rollback()
+        put_connection(conn)
+
+
+_sub_analysis_counts: Dict[str, int] = {}
+
+
+def count_pipeline_sub_analyses(pipeline_name: str) -> int:
+    """
+    Number of sub analyses a row of pipeline_name creates (one per step of the pipeline), cached per pipeline
+    """
+    if pipeline_name not in _sub_analysis_counts:
+        conn = get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT json_array_length((meta->'sub_analyses')::json) "
+                               "FROM analysis_pipelines WHERE name = %s", (pipeline_name,))
+                row = cursor.fetchone()
+        finally:
+            conn.rollback()
+            put_connection(conn)
+        # an unknown pipeline fails in submit_analysis, count it as one
+        _sub_analysis_counts[pipeline_name] = max(row[0] or 1, 1) if row else 1
+    return _sub_analysis_counts[pipeline_name]
+
+
+def submit_jobs_scheduled(
+    jobs: Iterable[Job],
+    max_active: int,
+    max_per_hour: Optional[int] = None,
+    concurrency: int = 1,
+    poll_seconds: float = POLL_SECONDS,
+    checkpoint: Optional[Checkpoint] = None,
+    allow_duplicates: bool = False,
+) -> None:
+    """
+    Submit the rows whenever the active sub analyses are below max_active, at most max_per_hour
+    rows per (sliding) hour and concurrency submissions at the same time.
+
+    A row counts as the number of sub analyses it creates, a row that does not fit below max_active
+    waits until it does (or, if it is larger than max_active by itself, until nothing is active).
+    """
+    pending = pending_jobs(jobs, checkpoint)
+    exhausted = False
+    # future -> sub analyses of the row being submitted
+    in_flight: Dict[Any, int] = {}
+    # next row to submit, (row_no, row_key, args, sub analyses), kept while it does not fit
+    held = None
+    submit_times: deque = deque()
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="submit") as pool:
+        while not exhausted or in_flight or held:
+            now = time.monotonic()
+            while submit_times and now - submit_times[0] > 3600:
+                submit_times.popleft()
+
+            active = count_active_sub_analyses()
+            # rows being submitted are not in the database yet, count their sub analyses as load
+            load = active + sum(in_flight.values())
+
+            logging.info("Active sub analyses: %s (high-water mark %s), rows in flight: %s, load: %s",
+                         active, max_active, len(in_flight), load)
+
+            while len(in_flight) < concurrency and (max_per_hour is None or len(submit_times) < max_per_hour):
+                if held is None:
+                    next_job = next(pending, None)
+                    if next_job is None:
+                        exhausted = True
+                        break
+                    row_no, row_key, job = next_job
+                    args = parse_job(row_no, job)
+                    if args is None:
+                        continue
+                    held = (row_no, row_key, args, count_pipeline_sub_analyses(args["analysis_pipeline_name"]))
+
+                row_no, row_key, args, sub_analyses = held
+                if load + sub_analyses > max_active and load > 0:
+                    logging.info("Row %s (%s sub analyses) waits for the load to drop", row_no, sub_analyses)
+                    break
+
+                logging.info("Submitting row %s (%s sub analyses)", row_no, sub_analyses)
+                future = pool.submit(submit_row, row_no, row_key, args, checkpoint, allow_duplicates)
+                in_flight[future] = sub_analyses
+                load += sub_analyses
+                submit_times.append(now)
+                held = None
+
+            if in_flight:
+                done, _ = wait(set(in_flight), timeout=poll_seconds, return_when=FIRST_COMPLETED)
+                for future in done:
+                    del in_flight[future]
+                    if future.exception() is not None:
+                        logging.error("Submission failed: %r", future.exception())
+            elif not exhausted or held:
+                time.sleep(poll_seconds)
+
 
 def main(argv: List[str]) -> None:
     parser = argparse.ArgumentParser(
@@ -139,6 +482,53 @@ def main(argv: List[str]) -> None:
         ),
     )
 
+    parser.add_argument(
+        "--max-active",
+        type=int,
+        default=None,
+        help=(
+            "Scheduler mode: submit rows whenever fewer than this many sub analyses are "
+            "queued or running, instead of sleeping a fixed interval."
+        ),
+    )
+    parser.add_argument(
+        "--max-per-hour",
+        type=int,
+        default=None,
+        help="Scheduler mode: maximum number of rows submitted per hour.",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=1,
+        help=(
+            "Scheduler mode: maximum number of submissions running at the same time. Without "
+            "--allow-duplicates the duplicate check serializes the submissions themselves."
+        ),
+    )
+    parser.add_argument(
+        "--poll-seconds",
+        type=float,
+        default=POLL_SECONDS,
+        help=f"Scheduler mode: seconds between load checks. Defaults to {POLL_SECONDS}.",
+    )
+
+    parser.add_argument(
+        "--state-file",
+        default=None,
+        help="Checkpoint file of the submitted rows. Defaults to <csv_path>.state.jsonl.",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Validate every row and report what would be submitted, without submitting.",
+    )
+    parser.add_argument(
+        "--allow-duplicates",
+        action="store_true",
+        help="Also submit rows that have an identical analysis queued, running or finished.",
+    )
+
     args = parser.parse_args(argv[1:])
 
     csv_path = Path(args.csv_path)
@@ -153,19 +543,45 @@ def main(argv: List[str]) -> None:
             sys.exit(1)
         interval_seconds = int(args.interval_minutes * 60)
 
+    if args.max_active is not None and args.max_active < 1:
+        print(f"Invalid --max-active: {args.max_active!r} (must be positive)")
+        sys.exit(1)
+    if args.max_per_hour is not None and args.max_per_hour < 1:
+        print(f"Invalid --max-per-hour: {args.max_per_hour!r} (must be positive)")
+        sys.exit(1)
+    if args.concurrency < 1:
+        print(f"Invalid --concurrency: {args.concurrency!r} (must be positive)")
+        sys.exit(1)
+
     logging.basicConfig(
         format="%(asctime)s,%(msecs)d %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s",
         datefmt="%H:%M:%S",
         level=logging.INFO,
     )
 
-    logging.info("Reading jobs from %s", csv_path)
-    jobs = read_jobs(csv_path)
-    if not jobs:
-        logging.info("No jobs found in CSV, exiting")
-        return
-
-    submit_jobs(jobs, interval_seconds=interval_seconds)
+    state_path = Path(args.state_file) if args.state_file else csv_path.with_name(csv_path.name + ".state.jsonl")
+    checkpoint = Checkpoint(state_path)
+    logging.info("Reading jobs from %s, checkpoint %s (%s rows recorded)", csv_path, state_path, len(checkpoint.rows))
+
+    try:
+        if args.dry_run:
+            if not dry_run(read_jobs(csv_path), checkpoint):
+                sys.exit(1)
+        elif args.max_active is not None:
+            submit_jobs_scheduled(
+                read_jobs(csv_path),
+                max_active=args.max_active,
+                max_per_hour=args.max_per_hour,
+                concurrency=args.concurrency,
+                poll_seconds=args.poll_seconds,
+                checkpoint=checkpoint,
+                allow_duplicates=args.allow_duplicates,
+            )
+        else:
+            submit_jobs(read_jobs(csv_path), interval_seconds=interval_seconds, checkpoint=checkpoint,
+                        allow_duplicates=args.allow_duplicates)
+    finally:
+        checkpoint.close()
 
 
 if __name__ == "__main__":
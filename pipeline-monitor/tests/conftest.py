@@ -0,0 +1,29 @@
+import os
+import sys
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import pipeline_monitor  # noqa: F401
+except ImportError:
+    # Stand-in with the call signature of pipeline_monitor.submit_analysis, so calls with
+    # unexpected arguments fail here as they would against the real module
+    pipeline_monitor = types.ModuleType("pipeline_monitor")
+
+    def submit_analysis(plate_acquisition, analysis_pipeline_name, cellprofiler_version,
+                        well_filter, site_filter, z_plane="", priority_string="", run_on_uppmax=False,
+                        run_on_pharmbio=False, run_on_haswell=False, run_on_pelle=False, run_on_hpcdev=False,
+                        run_location=None, submitted_by=None):
+        raise AssertionError("submit_analysis must be patched in tests")
+
+    def get_connection():
+        raise AssertionError("get_connection must be patched in tests")
+
+    def put_connection(conn):
+        raise AssertionError("put_connection must be patched in tests")
+
+    pipeline_monitor.submit_analysis = submit_analysis
+    pipeline_monitor.get_connection = get_connection
+    pipeline_monitor.put_connection = put_connection
+    sys.modules["pipeline_monitor"] = pipeline_monitor
@@ -0,0 +1,105 @@
+import inspect
+
+import pytest
+
+import pipeline_monitor
+import submit_from_csv
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        self.conn.queries.append((query, params))
+
+    def fetchone(self):
+        return [self.conn.duplicate_of]
+
+
+class FakeConnection:
+    def __init__(self, duplicate_of=None):
+        self.duplicate_of = duplicate_of
+        self.queries = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+@pytest.fixture
+def submitted(monkeypatch):
+    """
+    Calls of submit_analysis, checked against the signature of pipeline_monitor.submit_analysis
+    """
+    calls = []
+    signature = inspect.signature(pipeline_monitor.submit_analysis)
+
+    def submit_analysis(*args, **kwargs):
+        calls.append(signature.bind(*args, **kwargs).arguments)
+        return "OK"
+
+    monkeypatch.setattr(submit_from_csv, "submit_analysis", submit_analysis)
+    return calls
+
+
+@pytest.fixture
+def connection(monkeypatch):
+    conn = FakeConnection()
+    monkeypatch.setattr(submit_from_csv, "get_connection", lambda: conn)
+    monkeypatch.setattr(submit_from_csv, "put_connection", lambda c: None)
+    return conn
+
+
+def make_args(plate_acquisition=3000):
+    row = {"plate_acquisition": str(plate_acquisition), "analysis_pipeline_name": "pipe",
+           "cellprofiler_version": "v4.2.5", "well_filter": "B02,C03", "submitted_by": "someone"}
+    return submit_from_csv.parse_job(1, row)
+
+
+def test_submit_row_calls_submit_analysis_with_its_signature(submitted, connection):
+    status = submit_from_csv.submit_row(1, "key", make_args(), None)
+
+    assert status == "submitted"
+    assert len(submitted) == 1
+    assert submitted[0]["plate_acquisition"] == 3000
+    assert submitted[0]["well_filter"] == "B02,C03"
+    assert submitted[0]["submitted_by"] == "someone"
+
+    queries = [query for query, params in connection.queries]
+    assert "pg_advisory_lock" in queries[0]
+    assert "submission_fingerprint" in queries[1]
+    assert "pg_advisory_unlock" in queries[-1]
+
+
+def test_submit_row_skips_duplicate(submitted, connection, tmp_path):
+    connection.duplicate_of = 42
+    checkpoint = submit_from_csv.Checkpoint(tmp_path / "state.jsonl")
+
+    status = submit_from_csv.submit_row(1, "key", make_args(), checkpoint)
+
+    assert status == "skipped"
+    assert submitted == []
+    assert checkpoint.rows["key"]["result"] == {"duplicate_of": 42}
+    assert "pg_advisory_unlock" in connection.queries[-1][0]
+
+
+def test_submit_row_allow_duplicates_skips_lookup(submitted, connection):
+    connection.duplicate_of = 42
+
+    status = submit_from_csv.submit_row(1, "key", make_args(), None, allow_duplicates=True)
+
+    assert status == "submitted"
+    assert len(submitted) == 1
+    assert connection.queries == []
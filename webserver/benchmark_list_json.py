@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Compare the two ways the list endpoints can build their JSON response body:
+rows encoded in Python (json_mode=python) or JSON built by Postgres (json_mode=postgres).
+
+Usage (from the webserver dir, with CONF_FILE pointing at a database with 10k+ rows):
+    python benchmark_list_json.py [--limit 10000] [--repeat 5]
+"""
+import argparse
+import logging
+import time
+import tracemalloc
+
+import dbqueries
+
+
+LISTINGS = {
+    'image_analyses': dbqueries.list_image_analyses,
+    'image_sub_analyses': dbqueries.list_image_sub_analyses,
+    'plate_acquisition': dbqueries.list_plate_acquisitions,
+}
+
+
+def consume(list_function, limit, json_mode):
+    n_bytes = 0
+    for chunk in list_function(limit, json_mode=json_mode):
+        n_bytes += len(chunk)
+    return n_bytes
+
+
+def run_once(list_function, limit, json_mode):
+    start = time.perf_counter()
+    n_bytes = consume(list_function, limit, json_mode)
+    return time.perf_counter() - start, n_bytes
+
+
+def peak_memory(list_function, limit, json_mode):
+    # separate run, tracemalloc slows down the Python side and would skew the timings
+    tracemalloc.start()
+    consume(list_function, limit, json_mode)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark python vs postgres JSON encoding of the list endpoints")
+    parser.add_argument("--limit", type=int, default=10000, help="Rows per listing")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per listing and mode, best run is reported")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    dbqueries.init_connection_pool()
+
+    print(f"{'listing':<20} {'mode':<10} {'best s':>8} {'peak MiB':>10} {'body MiB':>10}")
+    for name, list_function in LISTINGS.items():
+        for json_mode in ("python", "postgres"):
+            # first run warms up the connection pool and the view column cache
+            run_once(list_function, args.limit, json_mode)
+            runs = [run_once(list_function, args.limit, json_mode) for _ in range(args.repeat)]
+            elapsed, n_bytes = min(runs)
+            peak = peak_memory(list_function, args.limit, json_mode)
+            print(f"{name:<20} {json_mode:<10} {elapsed:>8.3f} {peak / 2**20:>10.1f} {n_bytes / 2**20:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
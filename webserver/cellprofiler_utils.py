@@ -1,19 +1,150 @@
+import collections
+import csv
+import hashlib
+import io
+import json
 import logging
 import os
+import threading
 from database import Database
 
 
 def get_imgsets(acq_id, well_filter=None, site_filter=None):
-        # fetch all images belonging to the plate acquisition
-        logging.info(f'Fetching images belonging to plate acqusition {acq_id}')
 
-        database = Database.get_instance()
+        imgsets, channel_maps = get_imgsets_for_acquisitions([(acq_id, well_filter, site_filter)])
 
-        images = database.get_imgages(acq_id, well_filter, site_filter)
+        return imgsets
 
-        imgsets = make_imgsets_from_images(images)
 
-        return imgsets
+def normalize_filter(filter_values):
+    # [None] or [''] means no filter
+    if not filter_values or filter_values[0] is None or filter_values[0] == '':
+        return None
+    return [str(value) for value in filter_values]
+
+
+def well_key(value):
+    # " b02" and "B02" are the same well
+    return str(value).strip().upper()
+
+
+def site_key(value):
+    # "01", " 1" and 1 are the same site
+    value = str(value).strip()
+    try:
+        return str(int(value))
+    except ValueError:
+        return value
+
+
+def get_imgsets_for_acquisitions(selections):
+    """
+    Fetch imgsets for many plate acquisitions with one image query and one channel map query.
+
+    selections is a list of (acq_id, well_filter, site_filter), the same acq_id may appear with
+    different filters. The query selects the union of all selections, the exact well/site
+    combinations are then picked out in memory.
+
+    Returns (imgsets, channel_maps) with imgsets in selection order and channel_maps {acq_id: channel_map}.
+    As with one get_imgsets per selection, an imgset keeps the position of the first selection that has it.
+    """
+    logging.info(f'Fetching images belonging to {len(selections)} plate acquisition selections')
+
+    # acq_id -> list of (wells, sites), None meaning all
+    wanted = {}
+    # (acq_id, wells, sites) in selection order
+    ordered_selections = []
+    for acq_id, well_filter, site_filter in selections:
+        wells = normalize_filter(well_filter)
+        sites = normalize_filter(site_filter)
+        # the same normalization for the query and the in memory match below
+        selection = (wells and {well_key(well) for well in wells}, sites and {site_key(site) for site in sites})
+        wanted.setdefault(int(acq_id), []).append(selection)
+        ordered_selections.append((int(acq_id),) + selection)
+
+    # The query filters on well/site only if every selection has that filter
+    all_wanted = [w for acq_wanted in wanted.values() for w in acq_wanted]
+    query_wells = None if any(wells is None for wells, sites in all_wanted) else sorted(set.union(*[wells for wells, sites in all_wanted]))
+    query_sites = None if any(sites is None for wells, sites in all_wanted) else sorted(set.union(*[sites for wells, sites in all_wanted]))
+
+    database = Database.get_instance()
+    images = database.get_images_for_acquisitions(list(wanted), query_wells, query_sites)
+    channel_maps = database.get_channel_maps_from_acq_ids(list(wanted))
+
+    images_by_acq = {}
+    for img in images:
+        images_by_acq.setdefault(img['plate_acquisition_id'], []).append(img)
+
+    imgsets = {}
+    for acq_id, wells, sites in ordered_selections:
+        acq_images = [img for img in images_by_acq.get(acq_id, [])
+                      if (wells is None or well_key(img['well']) in wells) and
+                         (sites is None or site_key(img['site']) in sites)]
+        imgsets.update(make_imgsets_from_images(acq_images))
+
+    return imgsets, channel_maps
+
+
+class ImgsetCsvCache:
+    """
+    In memory LRU cache of generated imgset csv files, bounded by total size in bytes.
+
+    Entries are stored per request key (selections and ICF settings) together with the image
+    counts of the acquisitions they were built from. When new images arrive for one of the
+    acquisitions the counts no longer match and the entry is replaced on the next request.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(selections, use_icf, icf_path):
+        normalized = [[int(acq_id), normalize_filter(well_filter), normalize_filter(site_filter)]
+                      for acq_id, well_filter, site_filter in selections]
+        return json.dumps([normalized, use_icf, icf_path])
+
+    @staticmethod
+    def make_etag(key, image_counts):
+        # the csv is fully determined by the request key and the images of the acquisitions
+        versions = sorted(image_counts.items())
+        digest = hashlib.sha1(json.dumps([key, versions]).encode()).hexdigest()
+        return f'"{digest}"'
+
+    def get(self, key, etag):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != etag:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, etag, csv_content):
+        size = len(csv_content)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old[1])
+            self._entries[key] = (etag, csv_content)
+            self._size += size
+            while self._size > self.max_bytes:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted[1])
+                logging.debug(f"Evicted imgset csv from cache: {evicted_key}")
+
+
+def get_imgset_etag(selections, use_icf, icf_path):
+    """
+    Cache key and ETag for an imgset request, costs one image count query
+    """
+    key = ImgsetCsvCache.make_key(selections, use_icf, icf_path)
+    acq_ids = sorted({int(acq_id) for acq_id, well_filter, site_filter in selections})
+    image_counts = Database.get_instance().get_image_counts(acq_ids)
+    return key, ImgsetCsvCache.make_etag(key, image_counts)
 
 
 def make_imgsets_from_images(images):
@@ -21,7 +152,7 @@ def make_imgsets_from_images(images):
     imgsets = {}
     for img in images:
 
-        logging.debug(f'img: {img["path"]}')
+        logging.debug('img: %s', img['path'])
         # readability
         imgset_key = f"{img['plate_acquisition_id']}-{img['well']}-{img['site']}"
 
@@ -29,100 +160,72 @@ def make_imgsets_from_images(images):
 
     return imgsets
 
-def get_cellprofiler_imgsets_csv(imgsets, channel_map, use_icf, icf_path):
-
-    logging.info("Inside make_imgset_csv")
+def get_cellprofiler_imgsets_header(channel_map, use_icf):
+    """
+    Column names of the CellProfiler imgset csv, channels in channel number order
+    """
+    ch_names = [ch_name for ch_nr, ch_name in sorted(channel_map.items())]
 
-    ### create header row
-    header = ""
+    header = [f"FileName_{ch_name}" for ch_name in ch_names] #header += f"FileName_w{ch_nr}_{ch_name},"
+    header += ["Group_Index", "Group_Number", "ImageNumber", "Metadata_Barcode", "Metadata_Site", "Metadata_Well", "Metadata_AcqID"]
+    header += [f"PathName_{ch_name}" for ch_name in ch_names]
+    header += [f"URL_{ch_name}" for ch_name in ch_names]
 
-    for ch_nr,ch_name in sorted(channel_map.items()):
-        header += f"FileName_{ch_name}," #header += f"FileName_w{ch_nr}_{ch_name},"
+    # Add Illumination correction headers if needed, first as URL_, then as PathName_ and FileName_
+    if use_icf:
+        header += [f"URL_ICF_{ch_name}" for ch_name in ch_names]
+        header += [f"PathName_ICF_{ch_name}" for ch_name in ch_names]
+        header += [f"FileName_ICF_{ch_name}" for ch_name in ch_names]
 
-    header += "Group_Index,Group_Number,ImageNumber,Metadata_Barcode,Metadata_Site,Metadata_Well,Metadata_AcqID,"
+    return header
 
-    for ch_nr,ch_name in sorted(channel_map.items()):
-        header += f"PathName_{ch_name},"
+def get_cellprofiler_imgsets_csv(imgsets, channel_map, use_icf, icf_path):
 
-    for ch_nr,ch_name in sorted(channel_map.items()):
-        header += f"URL_{ch_name},"
+    return "".join(iter_cellprofiler_imgsets_csv(imgsets, channel_map, use_icf, icf_path))
 
-    # Add Illumination correction headers if needed
-    if use_icf:
-        # First as URL_
-        for ch_nr,ch_name in sorted(channel_map.items()):
-            header += f"URL_ICF_{ch_name},"
+def iter_cellprofiler_imgsets_csv(imgsets, channel_map, use_icf, icf_path, rows_per_chunk=1000):
+    """
+    Generate the CellProfiler imgset csv in chunks of rows_per_chunk rows, header first
+    """
 
-        # And then as PathName_
-        for ch_nr,ch_name in sorted(channel_map.items()):
-            header += f"PathName_ICF_{ch_name},"
+    logging.info("Inside iter_cellprofiler_imgsets_csv")
 
-         # And then as FileName_
-        for ch_nr,ch_name in sorted(channel_map.items()):
-            header += f"FileName_ICF_{ch_name},"
+    # the header is not quoted
+    yield ",".join(get_cellprofiler_imgsets_header(channel_map, use_icf)) + "\n"
 
-    # remove last comma and add newline
-    header = header[:-1]+"\n"
-    ###
+    # illumination files are not unique per image, all images with same channel have the same
+    # correction image, so these columns are the same for every row
+    icf_values = []
+    if use_icf:
+        ch_names = [ch_name for ch_nr, ch_name in sorted(channel_map.items())]
+        icf_values += [f"file:{icf_path}/ICF_{ch_name}.npy" for ch_name in ch_names]
+        icf_values += [icf_path for ch_name in ch_names]
+        icf_values += [f"ICF_{ch_name}.npy" for ch_name in ch_names]
 
-    # init counter
-    content = ""
+    # strings are quoted, numbers are not
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC, lineterminator="\n")
 
     # for each imgset
     for imgset_counter,imgset in enumerate(imgsets.values()):
-        #pdb.set_trace()
-        # construct the csv row
-        row = ""
 
         # sort the images in the imgset by channel id
         sorted_imgset = sorted(imgset, key=lambda k: k['channel'])
+        paths = [img['path'] for img in sorted_imgset]
+        img = sorted_imgset[-1]
 
-        # add filenames
-        for img in sorted_imgset:
-            img_filename = os.path.basename(img['path'])
-            row += f'"{img_filename}",'
-
-        # add imgset info
-        row += (
-            f'{imgset_counter},1,{imgset_counter},'
-            f'"{img["plate_barcode"]}",{img["site"]},'
-            f'"{img["well"]}",{img["plate_acquisition_id"]},'
-        )
-
-        # add file paths
-        for img in sorted_imgset:
-            img_dirname = os.path.dirname(img['path'])
-            row += f'"{img_dirname}",'
-
-        # add file urls
-        for img in sorted_imgset:
-            path = img['path']
-            row += f'"file:{path}",'
-
-
-        # add illumination file names, both as URL_ and PATH_ - these are not uniqe per image,
-        # all images with same channel have the same correction image
-        if use_icf:
-
-            icf_path = icf_path
-
-            # First as URL
-            for ch_nr,ch_name in sorted(channel_map.items()):
-                icf_file_name = f'ICF_{ch_name}.npy'
-                path = f'{icf_path}/{icf_file_name}'
-                row +=  f'"file:{path}",'
-
-            # Also as PathName_
-            for ch_nr,ch_name in sorted(channel_map.items()):
-                row +=  f'"{icf_path}",'
+        row = [os.path.basename(path) for path in paths]
+        row += [imgset_counter, 1, imgset_counter,
+                img["plate_barcode"], img["site"], img["well"], img["plate_acquisition_id"]]
+        row += [os.path.dirname(path) for path in paths]
+        row += [f"file:{path}" for path in paths]
+        row += icf_values
 
-            # Also as FileName_
-            for ch_nr,ch_name in sorted(channel_map.items()):
-                icf_file_name = f'ICF_{ch_name}.npy'
-                row +=  f'"{icf_file_name}",'
+        writer.writerow(row)
 
-        # remove last comma and add a newline before adding it to the content
-        content += row[:-1] + "\n"
+        if (imgset_counter + 1) % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
 
-    # return the header and the content
-    return header + content
\ No newline at end of file
+    yield buffer.getvalue()
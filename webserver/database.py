@@ -1,7 +1,9 @@
 from __future__ import annotations
 import logging
 import json
+import time
 from typing import List, Optional, Dict, Any
+import psycopg2
 from psycopg2 import pool, extensions
 from psycopg2.extras import RealDictCursor
 from contextlib import contextmanager
@@ -18,14 +20,32 @@ class Database:
                 cls._instance.connection_pool = None  # Ensure the connection_pool is initially set to None
         return cls._instance
 
-    def initialize_connection_pool(self, **connection_info):
-        if not hasattr(self, 'initialized'):  # Prevent reinitialization
-            if connection_info:
-                # Initialize connection pool if it doesn't exist and connection_info is provided
-                self.connection_pool = pool.SimpleConnectionPool(minconn=1, maxconn=10, **connection_info)
-                self.initialized = True  # Mark as initialized
-            else:
-                raise ValueError("Connection information must be provided to initialize the connection pool.")
+    def initialize_connection_pool(self, minconn=1, maxconn=10, checkout_timeout=30, ping_idle_seconds=30, **connection_info):
+        with self._lock:  # Lazy initialization may happen from several worker threads
+            if not hasattr(self, 'initialized'):  # Prevent reinitialization
+                if connection_info:
+                    # Initialize connection pool if it doesn't exist and connection_info is provided.
+                    # ThreadedConnectionPool since handlers run queries from several worker threads.
+                    self.connection_pool = pool.ThreadedConnectionPool(minconn=minconn, maxconn=maxconn, **connection_info)
+                    # The pool itself raises PoolError when exhausted, the semaphore makes callers wait for a free slot instead
+                    self._slots = threading.BoundedSemaphore(maxconn)
+                    self._checkout_timeout = checkout_timeout
+                    self._ping_idle_seconds = ping_idle_seconds
+                    self._last_released = {}
+                    self._stats_lock = threading.Lock()
+                    self._stats = {'minconn': minconn,
+                                   'maxconn': maxconn,
+                                   'in_use': 0,
+                                   'checkouts': 0,
+                                   'waited': 0,
+                                   'exhausted': 0,
+                                   'discarded': 0}
+                    self.initialized = True  # Mark as initialized
+                else:
+                    raise ValueError("Connection information must be provided to initialize the connection pool.")
+
+    def is_initialized(self):
+        return self.connection_pool is not None
 
     @classmethod
     def get_instance(cls):
@@ -35,14 +55,94 @@ class Database:
     def get_connection(self):
         if self.connection_pool is None:
             raise Exception("Connection pool has not been initialized.")
-        return self.connection_pool.getconn()
+
+        # Wait for a free slot, count how often the pool was exhausted
+        if not self._slots.acquire(blocking=False):
+            self._count('waited')
+            logging.warning("Connection pool exhausted, waiting for a free connection")
+            if not self._slots.acquire(timeout=self._checkout_timeout):
+                self._count('exhausted')
+                raise pool.PoolError(f"Connection pool exhausted, no connection available within {self._checkout_timeout} s")
+
+        try:
+            conn = self._checkout_healthy_connection()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._stats_lock:
+            self._stats['checkouts'] += 1
+            self._stats['in_use'] += 1
+        return conn
 
     def release_connection(self, conn):
         if self.connection_pool is not None:
-            self.connection_pool.putconn(conn)
+            close = conn.closed or conn.info.transaction_status == extensions.TRANSACTION_STATUS_UNKNOWN
+            if close:
+                self._count('discarded')
+                self._last_released.pop(id(conn), None)
+            else:
+                self._last_released[id(conn)] = time.monotonic()
+            self.connection_pool.putconn(conn, close=close)
+            with self._stats_lock:
+                self._stats['in_use'] -= 1
+            self._slots.release()
         else:
             raise Exception("Connection pool has not been initialized.")
 
+    @contextmanager
+    def connection(self):
+        """
+        Check out a pooled connection for the duration of a with-block.
+        Uncommitted work is rolled back when the connection is returned.
+        """
+        conn = self.get_connection()
+        try:
+            yield conn
+        finally:
+            self.release_connection(conn)
+
+    def get_pool_stats(self) -> Dict[str, Any]:
+        if self.connection_pool is None:
+            return {}
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['idle'] = len(self.connection_pool._pool)
+        return stats
+
+    def _count(self, key):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def _checkout_healthy_connection(self):
+        # Hand out at most maxconn + 1 broken connections before giving up
+        for _ in range(self._stats['maxconn'] + 1):
+            conn = self.connection_pool.getconn()
+            if self._is_healthy(conn):
+                return conn
+            logging.warning("Discarding broken pooled connection")
+            self._count('discarded')
+            self._last_released.pop(id(conn), None)
+            self.connection_pool.putconn(conn, close=True)
+        raise pool.PoolError("Could not get a healthy connection from pool")
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+
+        # Only ping connections that have been idle for a while, warm ones are assumed alive
+        last_released = self._last_released.get(id(conn))
+        if last_released is None or time.monotonic() - last_released < self._ping_idle_seconds:
+            return True
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+
     def execute_query(self, query, params=None, fetch="all", commit=False, cursor_factory=extensions.cursor):
         conn = self.get_connection()
         try:
@@ -94,6 +194,68 @@ class Database:
         imgs = self.execute_query(query, params, cursor_factory=RealDictCursor)
         return imgs
 
+    def get_images_for_acquisitions(self, acq_ids, well_filter=None, site_filter=None):
+        """
+        Images of all plate acquisitions in acq_ids in one query, ordered by acquisition
+        and then like get_imgages. Well and site filters apply to all acquisitions.
+        """
+        logging.info(f'Fetching images belonging to {len(acq_ids)} plate acquisitions.')
+
+        query = """
+            SELECT *
+            FROM images_all_view
+            WHERE plate_acquisition_id = ANY(%s)
+        """
+        params = [list(acq_ids)]
+
+        # IN with a tuple (instead of ANY with a list) lets Postgres coerce the filter strings to the column type
+        if site_filter:
+            query += " AND site IN %s"
+            params.append(tuple(site_filter))
+
+        if well_filter:
+            query += " AND well IN %s"
+            params.append(tuple(well_filter))
+
+        query += " ORDER BY plate_acquisition_id, timepoint, well, site, channel"
+
+        return self.execute_query(query, params, cursor_factory=RealDictCursor)
+
+    def get_image_counts(self, acq_ids):
+        """
+        Number of images per plate acquisition, {acq_id: count}, used to notice when new images arrive
+        """
+        query = """
+            SELECT plate_acquisition_id, count(*)
+            FROM images_all_view
+            WHERE plate_acquisition_id = ANY(%s)
+            GROUP BY plate_acquisition_id
+        """
+        counts = self.execute_query(query, (list(acq_ids),), fetch="all")
+
+        image_counts = {acq_id: 0 for acq_id in acq_ids}
+        image_counts.update(dict(counts))
+        return image_counts
+
+    def get_channel_maps_from_acq_ids(self, acq_ids):
+        """
+        Channel maps of several plate acquisitions in one query: {acq_id: {channel: dye}}
+        """
+        query = """
+            SELECT pa.id AS acq_id, cm.*
+            FROM channel_map cm
+            INNER JOIN plate_acquisition pa ON cm.map_id = pa.channel_map_id
+            WHERE pa.id = ANY(%s)
+        """
+
+        channel_map_res = self.execute_query(query, (list(acq_ids),), fetch="all", cursor_factory=RealDictCursor)
+
+        channel_maps = {acq_id: {} for acq_id in acq_ids}
+        for channel in channel_map_res:
+            channel_maps[channel['acq_id']][channel['channel']] = channel['dye']
+
+        return channel_maps
+
     def get_channel_map_from_acq_id(self, acq_id):
         # Parameterized SQL query to get channel map based on acquisition ID
         query = """
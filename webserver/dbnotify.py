@@ -0,0 +1,131 @@
+"""
+Postgres LISTEN/NOTIFY listener, fans out the notifications of a channel to subscribers on the IOLoop.
+"""
+import logging
+
+import psycopg2
+import psycopg2.extensions
+import tornado.queues
+from tornado.ioloop import IOLoop
+
+import settings as pipelinegui_settings
+
+# Channel of the triggers in sql/002_analysis_status_notify.sql
+ANALYSIS_STATUS_CHANNEL = "analysis_status"
+
+
+class Notifier:
+    """
+    One autocommit connection (outside of the Database pool) that LISTENs on a channel. The connection
+    socket is registered with the IOLoop, so notifications are read without a thread and without polling.
+
+    The connection is opened in a thread, a slow or unreachable database does not block the IOLoop, and
+    uses TCP keepalives so a connection that died silently is noticed and reopened.
+
+    Every subscriber gets a queue of payloads. A subscriber that does not keep up, or that may have
+    missed notifications while the connection was down, gets RESYNC instead and should reload.
+    """
+
+    RESYNC = "resync"
+
+    def __init__(self, channel, reconnect_delay=5, queue_size=1000, connect_timeout=10):
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self.connect_timeout = connect_timeout
+        self.queue_size = queue_size
+        self.conn = None
+        # fd registered with the IOLoop, fileno() of a dead connection raises
+        self.fd = None
+        self.subscribers = set()
+
+    def start(self):
+        IOLoop.current().spawn_callback(self._start)
+
+    def _connect(self):
+        # runs in the executor
+        conn = psycopg2.connect(host=pipelinegui_settings.DB_HOSTNAME,
+                                port=pipelinegui_settings.DB_PORT,
+                                database=pipelinegui_settings.DB_NAME,
+                                user=pipelinegui_settings.DB_USER,
+                                password=pipelinegui_settings.DB_PASS,
+                                connect_timeout=self.connect_timeout,
+                                keepalives=1,
+                                keepalives_idle=30,
+                                keepalives_interval=10,
+                                keepalives_count=3)
+        try:
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cursor:
+                cursor.execute(f"LISTEN {self.channel}")
+        except psycopg2.Error:
+            conn.close()
+            raise
+        return conn
+
+    async def _start(self):
+        try:
+            self.conn = await IOLoop.current().run_in_executor(None, self._connect)
+            fd = self.conn.fileno()
+            IOLoop.current().add_handler(fd, self._on_readable, IOLoop.READ)
+            self.fd = fd
+            logging.info(f"Listening for notifications on channel {self.channel}")
+        except (psycopg2.Error, ValueError, OSError) as e:
+            logging.error(f"Could not listen on channel {self.channel}: {e}")
+            self._reconnect_later()
+            return
+
+        # notifications sent while not listening are lost
+        self._broadcast(self.RESYNC)
+
+    def _reconnect_later(self):
+        if self.fd is not None:
+            IOLoop.current().remove_handler(self.fd)
+            self.fd = None
+        if self.conn is not None:
+            # closed is 1 after close(), 2 when the connection broke, the socket is only released by close()
+            if self.conn.closed != 1:
+                self.conn.close()
+            self.conn = None
+        IOLoop.current().call_later(self.reconnect_delay, self.start)
+
+    def _on_readable(self, fd, events):
+        try:
+            self.conn.poll()
+        except psycopg2.Error as e:
+            logging.error(f"Lost connection listening on channel {self.channel}: {e}")
+            self._reconnect_later()
+            return
+
+        while self.conn.notifies:
+            notify = self.conn.notifies.pop(0)
+            self._broadcast(notify.payload)
+
+    def _broadcast(self, payload):
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait(payload)
+            except tornado.queues.QueueFull:
+                # the subscriber falls behind, drop its backlog and let it reload
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(self.RESYNC)
+
+    def subscribe(self):
+        queue = tornado.queues.Queue(maxsize=self.queue_size)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+
+
+_analysis_status_notifier = None
+
+def get_analysis_status_notifier():
+    """
+    The process wide Notifier of the analysis_status channel, start() it once on the IOLoop
+    """
+    global _analysis_status_notifier
+    if _analysis_status_notifier is None:
+        _analysis_status_notifier = Notifier(ANALYSIS_STATUS_CHANNEL)
+    return _analysis_status_notifier
@@ -5,49 +5,210 @@ import time
 import psycopg2
 import psycopg2.extras
 import settings as pipelinegui_settings
+import jsonutils
+from database import Database
+
+def init_connection_pool():
+    """
+    Initialize the shared Database connection pool from settings (no-op if already initialized)
+    """
+    db_settings = {
+        "host": pipelinegui_settings.DB_HOSTNAME,
+        "port": pipelinegui_settings.DB_PORT,
+        "database": pipelinegui_settings.DB_NAME,
+        "user": pipelinegui_settings.DB_USER,
+        "password": pipelinegui_settings.DB_PASS,
+    }
+    Database.get_instance().initialize_connection_pool(minconn=pipelinegui_settings.DB_POOL_MIN,
+                                                       maxconn=pipelinegui_settings.DB_POOL_MAX,
+                                                       checkout_timeout=pipelinegui_settings.DB_POOL_TIMEOUT,
+                                                       ping_idle_seconds=pipelinegui_settings.DB_POOL_PING_IDLE,
+                                                       **db_settings)
 
 def get_connection():
-    return psycopg2.connect(     host=pipelinegui_settings.DB_HOSTNAME,
-                                 port=pipelinegui_settings.DB_PORT,
-                                 database=pipelinegui_settings.DB_NAME,
-                                 user=pipelinegui_settings.DB_USER, password=pipelinegui_settings.DB_PASS)
+    database = Database.get_instance()
+    if not database.is_initialized():
+        init_connection_pool()
+    return database.get_connection()
 
 def put_connection(conn):
-    # Simple compatibility shim so this module mirrors the monitor's API
+    # Return connection to the pool, this module mirrors the monitor's API
     if conn is not None:
-        conn.close()
+        Database.get_instance().release_connection(conn)
 
-def list_plate_acquisitions():
+def list_plate_acquisitions(limit, since_id=None, json_mode=None):
+    """
+    Newest plate acquisitions first. With since_id only acquisitions newer than since_id are
+    returned, so clients that keep earlier results only fetch the delta.
+    """
 
     query = ("SELECT * "
-             "FROM plate_acquisition_v1 "
-             "ORDER BY id DESC "
-             "LIMIT 1000")
+             "FROM plate_acquisition_v1 ")
+    params = []
+
+    if since_id is not None:
+        query += "WHERE id > %s "
+        params.append(since_id)
+
+    query += ("ORDER BY id DESC "
+              "LIMIT %s")
+    params.append(limit)
+
+    if get_json_mode(json_mode) == "postgres":
+        return iter_table_json_from_postgres("plate_acquisition_v1", query, params, key_column="id")
+    return iter_table_json(query, params)
+
+# WHERE conditions for the sub-analysis/analysis states, written so partial indexes can be used
+STATE_CONDITIONS = {
+    'queued': "start IS NULL AND error IS NULL",
+    'started': "start IS NOT NULL AND finish IS NULL AND error IS NULL",
+    'finished': "finish IS NOT NULL AND error IS NULL",
+    'error': "error IS NOT NULL",
+}
+
+# Server side filters of the list endpoints, filter name -> WHERE clause (or state name -> clause for status)
+IMAGE_ANALYSES_FILTERS = {
+    'plate_barcode': "plate_barcode = %s",
+    'pipeline_name': "pipeline_name = %s",
+    'status': STATE_CONDITIONS,
+    'submitted_by': "meta->>'submitted_by' = %s",
+    'date_from': "start >= %s",
+    'date_to': "start < %s",
+}
+
+IMAGE_SUB_ANALYSES_FILTERS = {
+    'plate_barcode': "plate_barcode = %s",
+    'pipeline_name': "analyses_id IN (SELECT id FROM image_analyses WHERE pipeline_name = %s)",
+    'status': STATE_CONDITIONS,
+    'submitted_by': "analyses_id IN (SELECT id FROM image_analyses WHERE meta->>'submitted_by' = %s)",
+    'date_from': "start >= %s",
+    'date_to': "start < %s",
+}
+
+def list_image_analyses(limit, before_id=None, after_id=None, filters=None, json_mode=None):
+
+    query, params = build_page_query("image_analyses_v1", "id", IMAGE_ANALYSES_FILTERS,
+                                     limit, before_id, after_id, filters)
+    cursor_from_first_row = after_id is not None and before_id is None
+
+    if get_json_mode(json_mode) == "postgres":
+        return iter_table_json_from_postgres("image_analyses_v1", query, params, key_column="id", page_size=limit,
+                                             cursor_from_first_row=cursor_from_first_row)
+    return iter_table_json(query, params, key_column="id", page_size=limit,
+                           cursor_from_first_row=cursor_from_first_row)
+
+def list_image_sub_analyses(limit, before_id=None, after_id=None, filters=None, json_mode=None):
+
+    query, params = build_page_query("image_sub_analyses_v1", "sub_id", IMAGE_SUB_ANALYSES_FILTERS,
+                                     limit, before_id, after_id, filters)
+    cursor_from_first_row = after_id is not None and before_id is None
+
+    if get_json_mode(json_mode) == "postgres":
+        return iter_table_json_from_postgres("image_sub_analyses_v1", query, params, key_column="sub_id", page_size=limit,
+                                             cursor_from_first_row=cursor_from_first_row)
+    return iter_table_json(query, params, key_column="sub_id", page_size=limit,
+                           cursor_from_first_row=cursor_from_first_row)
+
+def build_filter_where(filter_clauses, filters):
+    """
+    Translate filter values into WHERE conditions and params, empty values are ignored.
+    Raises ValueError for unknown filters or states.
+    """
+    conditions = []
+    params = []
+    for name, value in (filters or {}).items():
+        if value is None or value == '':
+            continue
+        if name not in filter_clauses:
+            raise ValueError(f"Unknown filter: {name}")
+
+        clause = filter_clauses[name]
+        if isinstance(clause, dict):
+            if value not in clause:
+                raise ValueError(f"Unknown {name}: {value}, expected one of {list(clause)}")
+            conditions.append(f"({clause[value]})")
+        else:
+            conditions.append(f"({clause})")
+            params.append(value)
+
+    return conditions, params
+
+def build_page_query(view, key_column, filter_clauses, limit, before_id=None, after_id=None, filters=None):
+    """
+    Keyset pagination query over view, rows always come newest first.
+
+    before_id gives the page of rows older than the cursor, after_id the rows newer than it.
+    """
+    conditions, params = build_filter_where(filter_clauses, filters)
+
+    if before_id is not None:
+        conditions.insert(0, f"{key_column} < %s")
+        params.insert(0, before_id)
+    if after_id is not None:
+        conditions.insert(0, f"{key_column} > %s")
+        params.insert(0, after_id)
+
+    query = f"SELECT * FROM {view} "
+    if conditions:
+        query += "WHERE " + " AND ".join(conditions) + " "
+
+    if after_id is not None and before_id is None:
+        # Walk away from the cursor (oldest first) and then flip the page to newest first
+        query = f"SELECT * FROM ({query}ORDER BY {key_column} ASC LIMIT %s) AS page ORDER BY {key_column} DESC"
+    else:
+        query += f"ORDER BY {key_column} DESC LIMIT %s"
+    params.append(limit)
+
+    return query, params
+
+def iter_table_json(query, params=None, key_column=None, page_size=None, cursor_from_first_row=False, batch_size=500):
+    """
+    Run query and yield the JSON response body in chunks of batch_size rows:
+    {"result": [[colnames], [row], ...]} plus "page_size" and "next_cursor" when page_size is given.
+
+    The rows (a page, the list queries are limited to LIST_MAX_PAGE_SIZE) are fetched and the
+    connection is returned to the pool before the first chunk is yielded, so a slow client does
+    not hold a pool connection while it reads. Values are encoded once with jsonutils, chunk by
+    chunk, without the dumps/loads round trip in between.
+    """
 
-    resultlist = select_as_table_from_db(query)
-    return resultlist_to_json(resultlist)
+    logging.info("params=" + str(params))
+    logging.info("query=" + str(query))
 
-def list_image_analyses(limit):
+    conn = None
+    try:
 
-    query = ("SELECT * "
-             "FROM image_analyses_v1 "
-             "ORDER BY id DESC "
-             "LIMIT %s")
-    params = (limit,)
+        conn = get_connection()
 
-    resultlist = select_as_table_from_db(query, params)
-    return resultlist_to_json(resultlist)
+        start = time.time()
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+        colnames = [desc[0] for desc in cursor.description]
+        cursor.close()
 
-def list_image_sub_analyses(limit):
+        logging.info(f"rows: {len(rows)}, elapsed: {time.time() - start}")
 
-    query = ("SELECT * "
-             "FROM image_sub_analyses_v1 "
-             "ORDER BY sub_id DESC "
-             "LIMIT %s")
-    params = (limit,)
+    except (Exception, psycopg2.DatabaseError) as err:
+        logging.exception("Message")
+        raise err
+    finally:
+        if conn is not None:
+            put_connection(conn)
+
+    yield '{"result":[' + jsonutils.dumps(colnames)
 
-    resultlist = select_as_table_from_db(query, params)
-    return resultlist_to_json(resultlist)
+    for batch_start in range(0, len(rows), batch_size):
+        yield ''.join(',' + jsonutils.dumps(row) for row in rows[batch_start:batch_start + batch_size])
+
+    trailer = ']'
+    if page_size is not None:
+        next_cursor = None
+        if len(rows) == page_size:
+            key_index = colnames.index(key_column)
+            next_cursor = rows[0][key_index] if cursor_from_first_row else rows[-1][key_index]
+        trailer += ',"page_size":' + jsonutils.dumps(page_size) + ',"next_cursor":' + jsonutils.dumps(next_cursor)
+    yield trailer + '}'
 
 def select_image_analyses(id):
     query = ("SELECT * "
@@ -74,15 +235,169 @@ def select_image_sub_analyses(id):
 
     return select_from_db(query, params)
 
-def resultlist_to_json(resultlist):
-    # First dump to string (This is because datetime cant be converted to string without the default=str function)
-    result_jsonstring = json.dumps(resultlist, indent=2, default=str)
+def select_image_sub_analyses_page(id, offset, limit):
+    query = ("SELECT * "
+             "FROM image_sub_analyses_v1 "
+             "WHERE analyses_id = %s "
+             "ORDER by sub_id "
+             "LIMIT %s OFFSET %s")
+    params = (id, limit, offset)
+
+    return select_from_db(query, params)
 
-    # Then reload into json
-    result = json.loads(result_jsonstring)
+def select_analyses_progress(analysis_ids):
+    """
+    Progress of analyses from one grouped query over image_sub_analyses: number of sub analyses
+    per state, earliest start, latest finish and estimated remaining seconds (from the rate
+    sub analyses have finished at since the first one started)
+    """
+    state_counts = ", ".join(f"count(*) FILTER (WHERE {condition}) AS {state}"
+                             for state, condition in STATE_CONDITIONS.items())
+    query = ("SELECT analysis_id, count(*) AS total, "
+             f"{state_counts}, "
+             "min(start) AS first_start, "
+             "max(finish) AS last_finish, "
+             "extract(epoch FROM now() - min(start))::float AS elapsed_seconds "
+             "FROM image_sub_analyses "
+             "WHERE analysis_id = ANY(%s) "
+             "GROUP BY analysis_id "
+             "ORDER BY analysis_id")
+    params = (list(analysis_ids),)
+
+    results = select_from_db(query, params)
+
+    for progress in results:
+        remaining = progress['queued'] + progress['started']
+        if remaining == 0:
+            progress['estimated_remaining_seconds'] = 0
+        elif progress['finished'] > 0 and progress['elapsed_seconds'] is not None:
+            progress['estimated_remaining_seconds'] = round(progress['elapsed_seconds'] / progress['finished'] * remaining)
+        else:
+            progress['estimated_remaining_seconds'] = None
+        del progress['elapsed_seconds']
+
+    return results
+
+def select_scheduler_state():
+    """
+    Input of the submission scheduler (scheduler.py) from one connection:
+
+    pending: (sub_id, analysis_id, priority, submitted_by) tuples of the queued sub analyses whose
+             dependencies have finished, ordered by sub_id (tuples instead of dicts, there can be
+             tens of thousands)
+    running: submitted_by -> number of started and unfinished sub analyses
+    """
+    pending_query = ("SELECT s.sub_id, s.analysis_id, s.priority, COALESCE(a.meta->>'submitted_by', '') "
+                     "FROM image_sub_analyses s "
+                     "JOIN image_analyses a ON a.id = s.analysis_id "
+                     "WHERE s.start IS NULL AND s.finish IS NULL AND s.error IS NULL "
+                     "AND NOT EXISTS (SELECT 1 "
+                     "                FROM jsonb_array_elements_text(COALESCE(s.depends_on_sub_id::jsonb, '[]')) AS dep(sub_id) "
+                     "                JOIN image_sub_analyses d ON d.sub_id = dep.sub_id::integer "
+                     "                WHERE d.finish IS NULL) "
+                     "ORDER BY s.sub_id")
+    running_query = ("SELECT COALESCE(a.meta->>'submitted_by', ''), count(*) "
+                     "FROM image_sub_analyses s "
+                     "JOIN image_analyses a ON a.id = s.analysis_id "
+                     "WHERE s.start IS NOT NULL AND s.finish IS NULL AND s.error IS NULL "
+                     "GROUP BY 1")
+    conn = None
+    try:
+        conn = get_connection()
+        with conn.cursor() as cursor:
+            cursor.execute(pending_query)
+            pending = cursor.fetchall()
+            cursor.execute(running_query)
+            running = dict(cursor.fetchall())
+        conn.rollback()
+        return pending, running
+    except (Exception, psycopg2.DatabaseError) as err:
+        logging.exception("Message")
+        raise err
+    finally:
+        if conn is not None:
+            put_connection(conn)
 
-    # logging.debug(json.dumps(result, indent=2, default=str))
-    return result
+def get_json_mode(json_mode=None):
+    """
+    How list responses are encoded: "python" encodes rows fetched by psycopg2 (iter_table_json),
+    "postgres" lets the database build the JSON text (iter_table_json_from_postgres)
+    """
+    json_mode = json_mode or pipelinegui_settings.LIST_JSON_MODE
+    if json_mode not in ("python", "postgres"):
+        raise ValueError(f"Unknown json_mode: {json_mode}, expected python or postgres")
+    return json_mode
+
+# view name -> column names, views only change with a schema migration (and a server restart)
+_view_columns_cache = {}
+
+def get_view_columns(view):
+    if view not in _view_columns_cache:
+        conn = None
+        try:
+            conn = get_connection()
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT * FROM {view} LIMIT 0")
+            _view_columns_cache[view] = [desc[0] for desc in cursor.description]
+            cursor.close()
+        finally:
+            if conn is not None:
+                put_connection(conn)
+
+    return _view_columns_cache[view]
+
+def iter_table_json_from_postgres(view, query, params, key_column, page_size=None, cursor_from_first_row=False):
+    """
+    Same response body as iter_table_json, but the rows are turned into JSON by Postgres
+    (json_agg/json_build_array) and passed through as text without being decoded in Python.
+    query must select all columns of view.
+    """
+
+    colnames = get_view_columns(view)
+    row_array = ", ".join('t."' + col.replace('"', '""') + '"' for col in colnames)
+    key = '"' + key_column.replace('"', '""') + '"'
+
+    # ::text keeps psycopg2 from parsing the json it would otherwise decode into Python objects
+    json_query = (f"SELECT coalesce(json_agg(json_build_array({row_array}) ORDER BY t.{key} DESC)::text, '[]'), "
+                  f"count(*), max(t.{key}), min(t.{key}) "
+                  f"FROM ({query}) AS t")
+
+    logging.info("params=" + str(params))
+    logging.info("query=" + str(json_query))
+
+    conn = None
+    try:
+
+        conn = get_connection()
+
+        start = time.time()
+        cursor = conn.cursor()
+        cursor.execute(json_query, params)
+        rows_json, n_rows, max_key, min_key = cursor.fetchone()
+        cursor.close()
+
+        logging.info(f"rows: {n_rows}, elapsed: {time.time() - start}")
+
+    except (Exception, psycopg2.DatabaseError) as err:
+        logging.exception("Message")
+        raise err
+    finally:
+        if conn is not None:
+            put_connection(conn)
+
+    body = '{"result":[' + jsonutils.dumps(colnames)
+    if n_rows > 0:
+        # strip the outer brackets, the rows go after the header row
+        body += ',' + rows_json[1:-1]
+    body += ']'
+    if page_size is not None:
+        next_cursor = None
+        if n_rows == page_size:
+            next_cursor = max_key if cursor_from_first_row else min_key
+        body += ',"page_size":' + jsonutils.dumps(page_size) + ',"next_cursor":' + jsonutils.dumps(next_cursor)
+    body += '}'
+
+    yield body
 
 def select_as_table_from_db(query, params=None):
 
@@ -161,7 +476,7 @@ def list_analysis_pipelines():
         raise err
     finally:
         if conn is not None:
-            conn.close()
+            put_connection(conn)
 
 def save_analysis_pipelines(name, data):
 
@@ -192,12 +507,65 @@ def save_analysis_pipelines(name, data):
         raise err
     finally:
         if conn is not None:
-            conn.close()
+            put_connection(conn)
 
 def submit_analysis(plate_acquisition, analysis_pipeline_name,cellprofiler_version,
-                    well_filter, site_filter, z_plane="", priority_string="", run_on_uppmax=False, run_on_pharmbio=False, run_on_haswell=False, run_on_pelle=False, run_on_hpcdev=False, run_location=None, submitted_by=None):
-
-    logging.debug("save_analysis_pipelines")
+                    well_filter, site_filter, z_plane="", priority_string="", run_on_uppmax=False, run_on_pharmbio=False, run_on_haswell=False, run_on_pelle=False, run_on_hpcdev=False, run_location=None, submitted_by=None,
+                    allow_duplicates=False):
+    """
+    Submit the analysis pipeline for one plate_acquisition, returns its result from submit_analyses:
+    {'plate_acquisition', 'analysis_id', 'sub_ids'}, or with analysis_id None and 'duplicate_of' if skipped
+    """
+    results = submit_analyses([plate_acquisition], analysis_pipeline_name, cellprofiler_version,
+                              well_filter, site_filter, z_plane, priority_string, run_on_uppmax, run_on_pharmbio,
+                              run_on_haswell, run_on_pelle, run_on_hpcdev, run_location, submitted_by,
+                              allow_duplicates)
+
+    return results[0]
+
+# Key of the transaction level advisory lock that serializes the duplicate check and insert of submissions
+SUBMIT_ANALYSES_LOCK_KEY = 7208141
+
+def find_duplicate_analyses(cursor, plate_acquisitions, pipeline_name, analysis_meta_json):
+    """
+    Existing analyses (queued, running or finished) identical to a submission of pipeline_name with
+    analysis_meta_json for each of plate_acquisitions, as a dict plate_acquisition -> analysis id.
+
+    All plates are checked in one statement, one lookup per plate in the partial fingerprint index.
+    The advisory lock (held until the transaction ends) keeps concurrent submissions from both
+    passing the check before either of them is inserted.
+    """
+    cursor.execute("SELECT pg_advisory_xact_lock(%s)", (SUBMIT_ANALYSES_LOCK_KEY,))
+
+    query = ("SELECT candidate.plate_acquisition_id, min(a.id) "
+             "FROM unnest(%s::integer[]) AS candidate(plate_acquisition_id) "
+             "JOIN image_analyses a "
+             "  ON a.submission_fingerprint = submission_fingerprint(candidate.plate_acquisition_id, %s, %s::jsonb) "
+             " AND a.error IS NULL "
+             "GROUP BY candidate.plate_acquisition_id")
+    cursor.execute(query, (list(plate_acquisitions), pipeline_name, analysis_meta_json))
+    return dict(cursor.fetchall())
+
+def submit_analyses(plate_acquisitions, analysis_pipeline_name,cellprofiler_version,
+                    well_filter, site_filter, z_plane="", priority_string="", run_on_uppmax=False, run_on_pharmbio=False, run_on_haswell=False, run_on_pelle=False, run_on_hpcdev=False, run_location=None, submitted_by=None,
+                    allow_duplicates=False):
+    """
+    Submit the analysis pipeline for all plate_acquisitions in one transaction, either all plates
+    are submitted or none. The pipeline is loaded once and analyses and sub-analyses are inserted
+    with multi-row INSERTs, one statement for the analyses and one per sub-analysis step
+    (each step depends on the sub-analysis of the previous step of the same analysis).
+
+    Plates with an identical analysis (same submission fingerprint, see sql/003_submission_fingerprint.sql)
+    that is queued, running or finished are skipped, unless allow_duplicates is set.
+
+    Returns a list with one result per plate: {'plate_acquisition', 'analysis_id', 'sub_ids'},
+    skipped plates have analysis_id None and the id of the existing analysis in 'duplicate_of'
+    """
+
+    logging.debug("submit_analyses")
+
+    if not plate_acquisitions:
+        return []
 
     conn = None
     try:
@@ -210,7 +578,8 @@ def submit_analysis(plate_acquisition, analysis_pipeline_name,cellprofiler_versi
         assert cursor0 is not None
         cursor0.execute(select_query, (analysis_pipeline_name,))
         first_row = cursor0.fetchone()
-        assert first_row is not None
+        if first_row is None:
+            raise ValueError(f"Analysis pipeline does not exist: {analysis_pipeline_name}")
         pipeline_name = first_row[0]
         meta = first_row[1]
         cursor0.close()
@@ -251,14 +620,33 @@ def submit_analysis(plate_acquisition, analysis_pipeline_name,cellprofiler_versi
 
         # Build query
         query = ("INSERT INTO image_analyses(plate_acquisition_id, pipeline_name, meta) "
-                 "VALUES (%s, %s, %s) RETURNING id")
+                 "VALUES %s RETURNING id, plate_acquisition_id")
 
         logging.info("query" + str(query))
 
+        # The same meta is used for all plates, so it is only serialized once
+        analysis_meta_json = json.dumps(analysis_meta)
+
         cursor = conn.cursor()
-        cursor.execute(query, [plate_acquisition, pipeline_name, json.dumps(analysis_meta)])
-        analysis_id = cursor.fetchone()[0]
-        cursor.close()
+
+        duplicates = {}
+        if not allow_duplicates:
+            duplicates = find_duplicate_analyses(cursor, plate_acquisitions, pipeline_name, analysis_meta_json)
+            for plate_acquisition, duplicate_of in duplicates.items():
+                logging.warning(f"Skipping plate_acquisition {plate_acquisition}, identical to analysis {duplicate_of}")
+
+        values = [(plate_acquisition, pipeline_name, analysis_meta_json)
+                  for plate_acquisition in plate_acquisitions if plate_acquisition not in duplicates]
+        if values:
+            analysis_rows = psycopg2.extras.execute_values(cursor, query, values, page_size=len(values), fetch=True)
+        else:
+            analysis_rows = []
+
+        results = {}
+        for analysis_id, plate_acquisition in analysis_rows:
+            results[analysis_id] = {'plate_acquisition': plate_acquisition,
+                                    'analysis_id': analysis_id,
+                                    'sub_ids': []}
 
         # Add uppmax setting to sub_analysis
         if run_on_uppmax:
@@ -313,25 +701,37 @@ def submit_analysis(plate_acquisition, analysis_pipeline_name,cellprofiler_versi
                 sub_analysis['z'] = z_plane
 
 
-        depends_on_id = []
+        # One multi-row insert per sub-analysis step, for all analyses at once,
+        # each step depends on the sub_id returned for the previous step of the same analysis
+        insert_sub_query = ("INSERT INTO image_sub_analyses(analysis_id, plate_acquisition_id, meta, depends_on_sub_id, priority) "
+                            "VALUES %s RETURNING sub_id, analysis_id")
         for sub_analysis in sub_analyses:
-            insert_sub_cursor = conn.cursor() # piro says https://stackoverflow.com/users/10138/piro
-            insert_sub_query = ("INSERT INTO image_sub_analyses(analysis_id, plate_acquisition_id, meta, depends_on_sub_id, priority) "
-                                "VALUES (%s,%s,%s,%s,%s) RETURNING sub_id")
-            insert_sub_cursor.execute(insert_sub_query, (analysis_id, plate_acquisition, json.dumps(sub_analysis),json.dumps(depends_on_id),priority))
-            returned_sub_id = insert_sub_cursor.fetchone()[0]
-            depends_on_id = [returned_sub_id]
+            sub_analysis_json = json.dumps(sub_analysis)
+            sub_values = []
+            for analysis_id, result in results.items():
+                depends_on_id = result['sub_ids'][-1:]
+                sub_values.append((analysis_id, result['plate_acquisition'], sub_analysis_json, json.dumps(depends_on_id), priority))
 
+            sub_rows = psycopg2.extras.execute_values(cursor, insert_sub_query, sub_values, page_size=len(sub_values), fetch=True)
+            for returned_sub_id, analysis_id in sub_rows:
+                results[analysis_id]['sub_ids'].append(returned_sub_id)
+
+        cursor.close()
         conn.commit()
 
-        return "OK"
+        skipped = [{'plate_acquisition': plate_acquisition,
+                    'analysis_id': None,
+                    'duplicate_of': duplicate_of,
+                    'sub_ids': []} for plate_acquisition, duplicate_of in duplicates.items()]
+
+        return list(results.values()) + skipped
 
     except (Exception, psycopg2.DatabaseError) as err:
         logging.exception("Message")
         raise err
     finally:
         if conn is not None:
-            conn.close()
+            put_connection(conn)
 
 def delete_analysis_pipelines(name):
 
@@ -359,7 +759,7 @@ def delete_analysis_pipelines(name):
         raise err
     finally:
         if conn is not None:
-            conn.close()
+            put_connection(conn)
 
 def delete_analysis(id):
 
@@ -399,7 +799,7 @@ def delete_from_db(query, values):
         raise err
     finally:
         if conn is not None:
-            conn.close()
+            put_connection(conn)
 
 
 def update_analysis_meta(analysis_id, analysis_meta):
@@ -434,7 +834,7 @@ def update_analysis_meta(analysis_id, analysis_meta):
         raise err
     finally:
         if conn is not None:
-            conn.close()
+            put_connection(conn)
 
 
 def select_from_db(query, params):
@@ -461,4 +861,4 @@ def select_from_db(query, params):
         raise err
     finally:
         if conn is not None:
-            conn.close()
+            put_connection(conn)
@@ -1,6 +1,24 @@
+import bisect
+import hashlib
+import json
 import logging
 import os
 import pathlib
+import tempfile
+import threading
+import time
+
+import settings as pipelinegui_settings
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+PIPELINES_DIR = "/cpp_work/pipelines/"
+
+# Seconds list_pipelinefiles waits for the first scan of the pipeline file index
+PIPELINE_INDEX_READY_TIMEOUT = 60
 
 def is_debug():
     """
@@ -13,9 +31,393 @@ def is_debug():
     return debug
 
 
-def list_pipelinefiles():
+class FileIndex:
+    """
+    Index of the files below a directory, relative path -> {'mtime', 'size', 'sha1'}.
+
+    A background thread keeps it up to date. With inotify_simple installed the directories are
+    watched and only the directories with events are read again, a full os.scandir rescan every
+    rescan_interval seconds catches changes inotify does not see (e.g. made by other NFS clients).
+    Files with unchanged mtime and size keep their hash, so a rescan only reads new or changed files.
+    Only files with a '.' in the name are indexed, as the rglob("*.*") listing did before.
+    Entries that can not be read are skipped, any other failure of the thread ends in a full rescan,
+    alive tells if the index is current, callers list the directory themselves when it is not.
+    """
+
+    def __init__(self, root, rescan_interval=300):
+        self.root = root
+        self.rescan_interval = rescan_interval
+        self._files = {}
+        self._dirs = set()
+        self._sorted_paths = []
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        # set after the first scan, also when it failed (e.g. root missing)
+        self._first_scan_done = threading.Event()
+        self._last_scan_ok = False
+        self._thread = None
+        self._inotify = None
+        self._watches = {}
+        self._watched_dirs = {}
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="file-index", daemon=True)
+            self._thread.start()
+        return self
+
+    def wait_until_ready(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def wait_for_first_scan(self, timeout=None):
+        """
+        Wait for the first scan to end, returns True if the index has been built (the scan did not fail)
+        """
+        self._first_scan_done.wait(timeout)
+        return self._ready.is_set()
+
+    @property
+    def alive(self):
+        """
+        True while the thread runs and its last full scan succeeded
+        """
+        return self._thread is not None and self._thread.is_alive() and self._last_scan_ok
+
+    def _run(self):
+        while True:
+            try:
+                if self._inotify is None and inotify_simple is not None:
+                    self._start_inotify()
+                self.rescan()
+                self._last_scan_ok = True
+            except Exception as e:
+                self._last_scan_ok = False
+                logging.error(f"Could not scan {self.root}: {e}")
+            self._first_scan_done.set()
+
+            try:
+                self._wait_and_refresh()
+            except Exception:
+                # e.g. an inotify queue overflow or a bug, the watches may be wrong, start over
+                logging.exception(f"File index of {self.root} failed, doing a full rescan")
+                self._stop_inotify()
+                time.sleep(min(self.rescan_interval, 10))
+
+    def _wait_and_refresh(self):
+        if self._inotify is None:
+            time.sleep(self.rescan_interval)
+            return
+
+        next_rescan = time.monotonic() + self.rescan_interval
+        while time.monotonic() < next_rescan:
+            timeout_ms = max(int((next_rescan - time.monotonic()) * 1000), 1)
+            events = self._inotify.read(timeout=timeout_ms, read_delay=100)
+            changed_dirs = {self._watches[event.wd] for event in events if event.wd in self._watches}
+            for rel_dir in sorted(changed_dirs):
+                try:
+                    self.refresh_dir(rel_dir)
+                except OSError as e:
+                    logging.error(f"Could not read {rel_dir} in {self.root}: {e}")
+
+    def _start_inotify(self):
+        try:
+            self._inotify = inotify_simple.INotify()
+        except OSError as e:
+            # e.g. out of inotify instances, the periodic rescans still keep the index current
+            logging.warning(f"Could not start inotify for {self.root}: {e}")
+            self._inotify = None
+
+    def _stop_inotify(self):
+        if self._inotify is not None:
+            try:
+                self._inotify.close()
+            except OSError:
+                pass
+        self._inotify = None
+        self._watches = {}
+        self._watched_dirs = {}
+
+    def _watch(self, rel_dir):
+        if self._inotify is None or rel_dir in self._watched_dirs:
+            return
+        flags = inotify_simple.flags
+        mask = flags.CREATE | flags.DELETE | flags.MODIFY | flags.MOVED_FROM | flags.MOVED_TO | flags.CLOSE_WRITE
+        try:
+            wd = self._inotify.add_watch(os.path.join(self.root, rel_dir), mask)
+            self._watches[wd] = rel_dir
+            self._watched_dirs[rel_dir] = wd
+        except OSError as e:
+            logging.warning(f"Could not watch {rel_dir}: {e}")
+
+    def _scan(self, rel_dir, old_files, files, dirs):
+        dirs.add(rel_dir)
+        self._watch(rel_dir)
+        with os.scandir(os.path.join(self.root, rel_dir)) as entries:
+            for entry in entries:
+                rel_path = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+                self._scan_entry(entry, rel_path, old_files, files, dirs)
+
+    def _scan_entry(self, entry, rel_path, old_files, files, dirs):
+        # one unreadable entry (e.g. a subdirectory without permission) does not stop the scan
+        try:
+            if entry.is_dir(follow_symlinks=True):
+                self._scan(rel_path, old_files, files, dirs)
+            elif '.' in entry.name and entry.is_file(follow_symlinks=True):
+                files[rel_path] = self._file_info(entry, old_files.get(rel_path))
+        except OSError as e:
+            logging.warning(f"Skipping {rel_path} in {self.root}: {e}")
+
+    def _file_info(self, entry, old_info):
+        stat = entry.stat()
+        if old_info is not None and old_info['mtime'] == stat.st_mtime and old_info['size'] == stat.st_size:
+            return old_info
+
+        sha1 = hashlib.sha1()
+        try:
+            with open(entry.path, 'rb') as file:
+                for block in iter(lambda: file.read(1024 * 1024), b''):
+                    sha1.update(block)
+        except OSError as e:
+            logging.warning(f"Could not hash {entry.path}: {e}")
+        return {'mtime': stat.st_mtime, 'size': stat.st_size, 'sha1': sha1.hexdigest()}
+
+    def rescan(self):
+        """
+        Read the whole directory tree again
+        """
+        start = time.time()
+        with self._lock:
+            old_files = self._files
+        files = {}
+        dirs = set()
+        self._scan("", old_files, files, dirs)
+
+        with self._lock:
+            self._files = files
+            self._dirs = dirs
+            self._sorted_paths = sorted(files)
+        self._ready.set()
+        logging.info(f"Indexed {len(files)} files in {self.root}, elapsed: {time.time() - start}")
+
+    def refresh_dir(self, rel_dir):
+        """
+        Read one directory again, new subdirectories are scanned and removed ones dropped from the index
+        """
+        with self._lock:
+            old_files = dict(self._files)
+            old_dirs = set(self._dirs)
+
+        prefix = rel_dir + os.sep if rel_dir else ""
+        def in_dir(path):
+            return path.startswith(prefix) and os.sep not in path[len(prefix):]
+
+        files = {path: info for path, info in old_files.items() if not in_dir(path)}
+        dirs = set(old_dirs)
+
+        if os.path.isdir(os.path.join(self.root, rel_dir)):
+            with os.scandir(os.path.join(self.root, rel_dir)) as entries:
+                subdirs = set()
+                for entry in entries:
+                    rel_path = prefix + entry.name
+                    try:
+                        if entry.is_dir(follow_symlinks=True):
+                            subdirs.add(rel_path)
+                            if rel_path not in old_dirs:
+                                self._scan(rel_path, old_files, files, dirs)
+                        elif '.' in entry.name and entry.is_file(follow_symlinks=True):
+                            files[rel_path] = self._file_info(entry, old_files.get(rel_path))
+                    except OSError as e:
+                        logging.warning(f"Skipping {rel_path} in {self.root}: {e}")
+            removed_dirs = [path for path in old_dirs if in_dir(path) and path != rel_dir and path not in subdirs]
+        else:
+            removed_dirs = [rel_dir]
+
+        for removed_dir in removed_dirs:
+            removed_prefix = removed_dir + os.sep
+            dirs = {path for path in dirs if path != removed_dir and not path.startswith(removed_prefix)}
+            files = {path: info for path, info in files.items() if not path.startswith(removed_prefix)}
+            for path, wd in list(self._watched_dirs.items()):
+                if path == removed_dir or path.startswith(removed_prefix):
+                    del self._watched_dirs[path]
+                    self._watches.pop(wd, None)
+
+        with self._lock:
+            self._files = files
+            self._dirs = dirs
+            self._sorted_paths = sorted(files)
+
+    def get(self, rel_path):
+        with self._lock:
+            return self._files.get(os.path.normpath(rel_path))
+
+    def search(self, prefix="", offset=0, limit=None):
+        """
+        Paths starting with prefix in sorted order, returns (page of paths, total number of matches)
+        """
+        with self._lock:
+            paths = self._sorted_paths
+            first = bisect.bisect_left(paths, prefix)
+            last = bisect.bisect_left(paths, prefix + '\U0010ffff') if prefix else len(paths)
+            total = last - first
+            start = min(first + offset, last)
+            end = last if limit is None else min(start + limit, last)
+            return paths[start:end], total
+
+
+_pipeline_file_index = None
+_pipeline_file_index_lock = threading.Lock()
+
+def get_pipeline_file_index():
+    """
+    The process wide FileIndex of the pipeline files, started on first use
+    """
+    global _pipeline_file_index
+    with _pipeline_file_index_lock:
+        if _pipeline_file_index is None:
+            _pipeline_file_index = FileIndex(PIPELINES_DIR, pipelinegui_settings.PIPELINE_INDEX_RESCAN_SECONDS).start()
+    return _pipeline_file_index
+
+
+def pipeline_file_exists(pipeline_file):
+    """
+    Check a pipeline file against the index, a file missing in the index may have been added since
+    the last scan and is checked on disk
+    """
+    file_index = get_pipeline_file_index()
+    if file_index.alive and file_index.get(pipeline_file) is not None:
+        return True
+    return os.path.isfile(os.path.join(PIPELINES_DIR, pipeline_file))
+
+
+def list_pipelinefiles(prefix="", offset=0, limit=None):
+    """
+    Table of the pipeline files from the index, optionally only a page of the files starting with prefix.
+    Returns (table, total number of matching files)
+    """
+    file_index = get_pipeline_file_index()
+    if file_index.wait_for_first_scan(timeout=PIPELINE_INDEX_READY_TIMEOUT) and file_index.alive:
+        paths, total = file_index.search(prefix, offset, limit)
+    else:
+        # the index is not current, list the pipeline dir as before the index
+        logging.warning(f"Pipeline file index of {PIPELINES_DIR} not available, listing the directory")
+        matching = sorted(row[0] for row in list_files(PIPELINES_DIR)[1:] if row[0].startswith(prefix))
+        total = len(matching)
+        paths = matching[offset:] if limit is None else matching[offset:offset + limit]
+
+    # create a table of the files with only one column and one file per row (each row is represented as a list)
+    result_table = [["Filename"]]
+    result_table.extend([path] for path in paths)
+
+    return result_table, total
+
+def read_file_head_tail(file_path, head_bytes, tail_bytes):
+    """
+    First head_bytes and last tail_bytes of a file, read with seek so large files are not read in full.
+    Returns {'size', 'head', 'head_end', 'tail', 'tail_start'}, tail is None when the whole file is in head.
+    Text is decoded as utf-8, characters split at a slice border are replaced.
+    """
+    with open(file_path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        if size <= head_bytes + tail_bytes:
+            head = file.read()
+            return {'size': size, 'head': head.decode('utf-8', errors='replace'), 'head_end': len(head),
+                    'tail': None, 'tail_start': len(head)}
+
+        head = file.read(head_bytes)
+        tail_start = size - tail_bytes
+        file.seek(tail_start)
+        tail = file.read(tail_bytes)
+
+    return {'size': size,
+            'head': head.decode('utf-8', errors='replace'), 'head_end': len(head),
+            'tail': tail.decode('utf-8', errors='replace'), 'tail_start': tail_start}
+
+
+def get_error_job_paths(sub_id, sub_out_path, sub_finished, limit=10):
+    """
+    Job directories of a sub analysis (first level below sub_out_path) with an "error" file.
+
+    The status of every job directory is kept in a sidecar index file per sub_id in ERROR_INDEX_DIR.
+    sub_out_path is only listed when its mtime has changed, the directories without error are then
+    checked (again) for an error file, a job can get its error file after it was first checked.
+    When the sub analysis has finished they are checked once more and the index becomes final, it
+    then costs one stat of sub_out_path, until its mtime changes (e.g. a job rerun) and the index is
+    updated again. A missing sub_out_path (sub analysis not started yet) has no jobs.
+    """
+    index_path = os.path.join(pipelinegui_settings.ERROR_INDEX_DIR, f"{sub_id}.json")
+    index = _read_error_index(index_path)
+
+    try:
+        updated_index = _update_error_index(index, sub_out_path, sub_finished)
+        if updated_index != index:
+            _write_error_index(index_path, updated_index)
+        index = updated_index
+    except OSError as e:
+        logging.error(f"Could not scan error jobs in {sub_out_path}: {e}")
+
+    error_jobs = sorted(name for name, status in index.get('jobs', {}).items() if status == 'error')
+    return [os.path.join(sub_out_path, name) for name in error_jobs[:limit]]
+
+
+def _update_error_index(index, sub_out_path, sub_finished):
+    jobs = dict(index.get('jobs', {}))
+
+    # stat before listing, directories created during the listing are picked up next time
+    try:
+        dir_mtime = os.stat(sub_out_path).st_mtime
+    except FileNotFoundError:
+        dir_mtime = None
+
+    dir_changed = index.get('dir_mtime') != dir_mtime
+    if index.get('final') and not dir_changed:
+        return index
+
+    if dir_mtime is None:
+        return {'dir_mtime': None, 'final': bool(sub_finished), 'jobs': jobs}
+
+    if dir_changed:
+        with os.scandir(sub_out_path) as entries:
+            for entry in entries:
+                if entry.name not in jobs and entry.is_dir():
+                    jobs[entry.name] = None
+
+    # on a changed directory and on the final pass all directories not in error yet, else only the new ones
+    recheck = dir_changed or sub_finished
+    for name, status in jobs.items():
+        if status is None or (recheck and status != 'error'):
+            is_error = os.path.isfile(os.path.join(sub_out_path, name, "error"))
+            jobs[name] = 'error' if is_error else 'ok'
+
+    return {'dir_mtime': dir_mtime, 'final': bool(sub_finished), 'jobs': jobs}
+
+
+def _read_error_index(index_path):
+    try:
+        with open(index_path) as index_file:
+            return json.load(index_file)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable error index {index_path}: {e}")
+        return {}
+
+
+def _write_error_index(index_path, index):
+    # write to a temp file and rename, readers never see a half written index
+    try:
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        # a unique temp file per writer, concurrent views of the same sub analysis may write at the same time
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(index_path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w') as index_file:
+                json.dump(index, index_file)
+            os.replace(tmp_path, index_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError as e:
+        logging.warning(f"Could not write error index {index_path}: {e}")
 
-    return list_files("/cpp_work/pipelines/")
 
 def list_files(input_path):
 
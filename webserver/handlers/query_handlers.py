@@ -6,38 +6,91 @@ import logging
 import os
 import json
 import re
+import functools
+import datetime
+import asyncio
+import threading
+import concurrent.futures
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 
 import tornado.web
-import datetime
-import decimal
+import tornado.escape
+import tornado.queues
+import tornado.iostream
+import tornado.util
+from tornado.ioloop import IOLoop
 
 import dbqueries
+import dbnotify
+import jsonutils
 import kubeutils
 import fileutils
 import pipelineutils
 from database import Database
 import cellprofiler_utils
+import thumbnails
+import scheduler
 import hpc_utils
+import settings as pipelinegui_settings
 
-def myserialize(obj):
-    """JSON serializer for objects not serializable by default json code"""
+# Bounded pool for the blocking DB, Kubernetes and NFS work, keeps the IOLoop thread free for other requests
+EXECUTOR = ThreadPoolExecutor(max_workers=pipelinegui_settings.EXECUTOR_WORKERS, thread_name_prefix="handler-worker")
 
-    if isinstance(obj, datetime.date):
-        serial = obj.isoformat()
-        return serial
+# NFS walks of the log page sections, separate from EXECUTOR so a large log page can not occupy all handler workers
+LOG_SECTION_EXECUTOR = ThreadPoolExecutor(max_workers=pipelinegui_settings.LOG_SECTION_WORKERS, thread_name_prefix="log-section-worker")
 
-    if isinstance(obj, datetime.datetime):
-        serial = obj.isoformat()
-        return serial
+# Generated imgset csv files, shared by all requests
+IMGSET_CSV_CACHE = cellprofiler_utils.ImgsetCsvCache(pipelinegui_settings.IMGSET_CACHE_MAX_BYTES)
 
-    if isinstance(obj, datetime.time):
-        serial = obj.isoformat()
-        return serial
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking function in the handler executor and await the result"""
+    return await IOLoop.current().run_in_executor(EXECUTOR, functools.partial(func, *args, **kwargs))
 
-    if isinstance(obj, decimal.Decimal):
-        return str(obj)
+async def write_chunks(handler, chunks):
+    """
+    Write the chunks of a blocking generator (e.g. dbqueries.iter_table_json or the imgset csv) to
+    the client as they are produced, each chunk is fetched in the executor and flushed before the next one.
+    """
+    try:
+        while True:
+            chunk = await run_blocking(next, chunks, None)
+            if chunk is None:
+                break
+            handler.write(chunk)
+            await handler.flush()
+    finally:
+        # Close the generator also when the client went away
+        await run_blocking(chunks.close)
+    handler.finish()
 
-    return obj.__dict__
+# Server side filters that are compared with a date column, passed to the query as datetime.date
+DATE_FILTERS = ('date_from', 'date_to')
+
+def get_page_arguments(handler, limit, filter_clauses):
+    """
+    Parse page size, before_id/after_id cursors and server side filters from the request,
+    invalid values are answered with 400
+    """
+    try:
+        page_size = min(int(limit), pipelinegui_settings.LIST_MAX_PAGE_SIZE)
+        before_id = handler.get_argument("before_id", None)
+        after_id = handler.get_argument("after_id", None)
+        before_id = int(before_id) if before_id else None
+        after_id = int(after_id) if after_id else None
+    except ValueError:
+        raise tornado.web.HTTPError(400, "limit, before_id and after_id must be integers")
+
+    filters = {name: handler.get_argument(name, None) for name in filter_clauses}
+    for name in DATE_FILTERS:
+        if filters.get(name):
+            try:
+                filters[name] = datetime.date.fromisoformat(filters[name])
+            except ValueError:
+                raise tornado.web.HTTPError(400, f"{name} must be a date, e.g. 2024-01-31")
+    json_mode = handler.get_argument("json_mode", None)
+
+    return {'limit': page_size, 'before_id': before_id, 'after_id': after_id, 'filters': filters, 'json_mode': json_mode}
 
 
 class ListPlateAcqHandler(tornado.web.RequestHandler): #pylint: disable=abstract-method
@@ -47,16 +100,26 @@ class ListPlateAcqHandler(tornado.web.RequestHandler): #pylint: disable=abstract
         body = "application/json"
         self.set_header(header, body)
 
-    def get(self, limit):
+    async def get(self, limit):
         """Handles GET requests.
         """
         logging.info("inside ListPlateAcqHandler, limit=" + str(limit))
 
-        result = dbqueries.list_plate_acquisitions()
+        try:
+            limit = min(int(limit), pipelinegui_settings.LIST_MAX_PAGE_SIZE)
+            since_id = self.get_argument("since_id", None)
+            since_id = int(since_id) if since_id else None
+        except ValueError:
+            raise tornado.web.HTTPError(400, "limit and since_id must be integers")
+
+        json_mode = self.get_argument("json_mode", None)
+        try:
+            chunks = dbqueries.list_plate_acquisitions(limit, since_id, json_mode)
+        except ValueError as e:
+            raise tornado.web.HTTPError(400, str(e))
+        await write_chunks(self, chunks)
 
         logging.info("done ListPlateAcqHandler, limit=" + str(limit))
-        #logging.debug(result)
-        self.finish({'result':result})
 
 class ListImageAnalysesHandler(tornado.web.RequestHandler): #pylint: disable=abstract-method
 
@@ -65,18 +128,20 @@ class ListImageAnalysesHandler(tornado.web.RequestHandler): #pylint: disable=abs
         body = "application/json"
         self.set_header(header, body)
 
-    def get(self, limit):
+    async def get(self, limit):
         """Handles GET requests.
         """
         logging.info("inside ListImageAnalysesHandler, limit=" + str(limit))
 
-        result = dbqueries.list_image_analyses(limit)
+        page_args = get_page_arguments(self, limit, dbqueries.IMAGE_ANALYSES_FILTERS)
+        try:
+            chunks = dbqueries.list_image_analyses(**page_args)
+        except ValueError as e:
+            raise tornado.web.HTTPError(400, str(e))
+        await write_chunks(self, chunks)
 
         logging.info("done ListImageAnalysesHandler, limit=" + str(limit))
 
-        #logging.debug(result)
-        self.finish({'result':result})
-
 class ListImageSubAnalysesHandler(tornado.web.RequestHandler): #pylint: disable=abstract-method
 
     def prepare(self):
@@ -84,18 +149,20 @@ class ListImageSubAnalysesHandler(tornado.web.RequestHandler): #pylint: disable=
         body = "application/json"
         self.set_header(header, body)
 
-    def get(self, limit):
+    async def get(self, limit):
         """Handles GET requests.
         """
         logging.info("inside ListImageSubAnalysesHandler, limit=" + str(limit))
 
-        result = dbqueries.list_image_sub_analyses(limit)
+        page_args = get_page_arguments(self, limit, dbqueries.IMAGE_SUB_ANALYSES_FILTERS)
+        try:
+            chunks = dbqueries.list_image_sub_analyses(**page_args)
+        except ValueError as e:
+            raise tornado.web.HTTPError(400, str(e))
+        await write_chunks(self, chunks)
 
         logging.info("done ListImageSubAnalysesHandler, limit=" + str(limit))
 
-        #logging.debug(result)
-        self.finish({'result':result})
-
 class ListJobsHandler(tornado.web.RequestHandler): #pylint: disable=abstract-method
 
     def prepare(self):
@@ -103,18 +170,32 @@ class ListJobsHandler(tornado.web.RequestHandler): #pylint: disable=abstract-met
         body = "application/json"
         self.set_header(header, body)
 
-    def get(self):
+    async def get(self):
         """Handles GET requests.
         """
         logging.info("inside ListJobsHandler")
 
-        result = kubeutils.list_jobs()
+        result = await run_blocking(kubeutils.list_jobs)
 
         logging.info("done ListJobsHandler")
 
         #logging.debug(result)
         self.finish({'result':result})
 
+class JobStatsHandler(tornado.web.RequestHandler): #pylint: disable=abstract-method
+
+    def prepare(self):
+        header = "Content-Type"
+        body = "application/json"
+        self.set_header(header, body)
+
+    async def get(self):
+        """Handles GET requests.
+        """
+        analysis_id = self.get_argument("analysis_id", None)
+        result = await run_blocking(kubeutils.get_job_stats, analysis_id)
+        self.finish({'result':result})
+
 class ListPipelinefilesHandler(tornado.web.RequestHandler): #pylint: disable=abstract-method
 
     def prepare(self):
@@ -122,17 +203,84 @@ class ListPipelinefilesHandler(tornado.web.RequestHandler): #pylint: disable=abs
         body = "application/json"
         self.set_header(header, body)
 
-    def get(self):
+    async def get(self):
         """Handles GET requests.
         """
         logging.info("inside ListPipelinefilesHandler")
 
-        result = fileutils.list_pipelinefiles()
+        prefix = self.get_argument("prefix", "")
+        try:
+            offset = int(self.get_argument("offset", 0))
+            limit = self.get_argument("limit", None)
+            limit = int(limit) if limit else None
+        except ValueError:
+            raise tornado.web.HTTPError(400, "offset and limit must be integers")
+
+        result, total = await run_blocking(fileutils.list_pipelinefiles, prefix, offset, limit)
 
         logging.info("done ListPipelinefilesHandler")
+        self.finish({'result':result, 'total':total, 'offset':offset})
+
+
+class DbPoolStatsHandler(tornado.web.RequestHandler): #pylint: disable=abstract-method
+
+    def prepare(self):
+        header = "Content-Type"
+        body = "application/json"
+        self.set_header(header, body)
+
+    def get(self):
+        """Handles GET requests.
+        """
+        result = Database.get_instance().get_pool_stats()
         self.finish({'result':result})
 
 
+class AnalysesProgressHandler(tornado.web.RequestHandler): #pylint: disable=abstract-method
+
+    def prepare(self):
+        header = "Content-Type"
+        body = "application/json"
+        self.set_header(header, body)
+
+    async def get(self):
+        """Handles GET requests, ids is a comma separated list of analysis ids
+        """
+        try:
+            analysis_ids = [int(id) for id in self.get_argument("ids").split(',') if id.strip()]
+        except ValueError:
+            raise tornado.web.HTTPError(400, "ids must be a comma separated list of integers")
+
+        if len(analysis_ids) > pipelinegui_settings.LIST_MAX_PAGE_SIZE:
+            raise tornado.web.HTTPError(400, f"at most {pipelinegui_settings.LIST_MAX_PAGE_SIZE} ids")
+
+        result = await run_blocking(dbqueries.select_analyses_progress, analysis_ids)
+        self.finish(jsonutils.dumps({'result':result}))
+
+
+class SchedulerOrderHandler(tornado.web.RequestHandler): #pylint: disable=abstract-method
+
+    def prepare(self):
+        header = "Content-Type"
+        body = "application/json"
+        self.set_header(header, body)
+
+    async def get(self):
+        """Handles GET requests, the dispatch order of the queued sub analyses (see scheduler.py),
+        optional limit and submitted_by arguments
+        """
+        try:
+            limit = int(self.get_argument("limit", 100))
+        except ValueError:
+            raise tornado.web.HTTPError(400, "limit must be an integer")
+        if not 1 <= limit <= pipelinegui_settings.LIST_MAX_PAGE_SIZE:
+            raise tornado.web.HTTPError(400, f"limit must be between 1 and {pipelinegui_settings.LIST_MAX_PAGE_SIZE}")
+
+        submitted_by = self.get_argument("submitted_by", None)
+
+        result = await run_blocking(scheduler.get_dispatch_order, limit, submitted_by)
+        self.finish({'result':result})
+
 
 class DeleteAnalysisPipelinesQueryHandler(tornado.web.RequestHandler): #pylint: disable=abstract-method
 
@@ -141,15 +289,33 @@ class DeleteAnalysisPipelinesQueryHandler(tornado.web.RequestHandler): #pylint:
         body = "application/json"
         self.set_header(header, body)
 
-    def get(self, name):
+    async def get(self, name):
         """Handles GET requests.
         """
         logging.info("name: " + str(name))
-        result = dbqueries.delete_analysis_pipelines(name)
+        result = await run_blocking(dbqueries.delete_analysis_pipelines, name)
 
         logging.debug(result)
         self.finish({'result':result})
 
+def get_log_arguments(handler):
+    """
+    Parse the pod, tail_lines and since_seconds arguments of the job log endpoints,
+    invalid values are answered with 400
+    """
+    try:
+        tail_lines = handler.get_argument("tail_lines", None)
+        since_seconds = handler.get_argument("since_seconds", None)
+        tail_lines = int(tail_lines) if tail_lines else None
+        since_seconds = int(since_seconds) if since_seconds else None
+    except ValueError:
+        raise tornado.web.HTTPError(400, "tail_lines and since_seconds must be integers")
+
+    pod_name = handler.get_argument("pod", None) or None
+
+    return {'pod_name': pod_name, 'tail_lines': tail_lines, 'since_seconds': since_seconds}
+
+
 class ListJobLogHandler(tornado.web.RequestHandler): #pylint: disable=abstract-method
 
     def prepare(self):
@@ -157,22 +323,159 @@ class ListJobLogHandler(tornado.web.RequestHandler): #pylint: disable=abstract-m
         body = "application/json"
         self.set_header(header, body)
 
-    def get(self, job_name):
+    async def get(self, job_name):
         """Handles GET requests.
         """
         logging.info("job_name: " + str(job_name))
-        result = kubeutils.get_job_log(job_name)
+        log_args = get_log_arguments(self)
+        result = await run_blocking(kubeutils.get_job_log, job_name, **log_args)
         logging.info("done job_name: " + str(job_name))
 
         logging.debug(result)
         self.finish({'result':result})
 
+class ListJobPodsHandler(tornado.web.RequestHandler): #pylint: disable=abstract-method
+
+    def prepare(self):
+        header = "Content-Type"
+        body = "application/json"
+        self.set_header(header, body)
+
+    async def get(self, job_name):
+        """Handles GET requests.
+        """
+        result = await run_blocking(kubeutils.list_job_pods, job_name)
+        self.finish({'result':result})
+
+class JobLogStreamHandler(tornado.web.RequestHandler): #pylint: disable=abstract-method
+    """
+    Server-sent events stream of the log of a job pod, arguments pod, tail_lines, since_seconds and follow.
+    Each batch of log lines is sent as a 'log' event, read errors as 'log_error' and 'end' when the log ends.
+
+    The log is read in a dedicated thread and not in the EXECUTOR, a followed log can stay open for hours.
+    """
+
+    async def get(self, job_name):
+        """Handles GET requests.
+        """
+        log_args = get_log_arguments(self)
+        follow = self.get_argument("follow", "true").lower() == "true"
+
+        pod_name = log_args['pod_name']
+        if pod_name is None:
+            pods = await run_blocking(kubeutils.list_job_pods, job_name)
+            if len(pods) == 0:
+                raise tornado.web.HTTPError(404, "Could not find a log, is pod started?")
+            pod_name = pods[0]['name']
+
+        logging.info(f"Streaming log of pod {pod_name}, follow: {follow}")
+
+        self._log_stream = await run_blocking(kubeutils.PodLogStream, pod_name, log_args['tail_lines'],
+                                              log_args['since_seconds'], follow)
+        self._queue = tornado.queues.Queue(maxsize=100)
+
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+
+        reader = threading.Thread(target=self._read_log, args=(asyncio.get_running_loop(),),
+                                  name=f"joblog-{pod_name}", daemon=True)
+        reader.start()
+
+        try:
+            while True:
+                item = await self._queue.get()
+                if item is None:
+                    break
+                event, lines = item
+                data = "".join(f"data: {line}\n" for line in (line.rstrip("\r") for line in lines))
+                self.write(f"event: {event}\n{data}\n")
+                await self.flush()
+
+            self.write("event: end\ndata: \n\n")
+            self.finish()
+        except tornado.iostream.StreamClosedError:
+            logging.info(f"Client closed log stream of pod {pod_name}")
+        finally:
+            self._log_stream.close()
+
+    def on_connection_close(self):
+        # unblocks the reader thread, which then ends the stream
+        if hasattr(self, '_log_stream'):
+            self._log_stream.close()
+
+    def _read_log(self, loop):
+        try:
+            for lines in self._log_stream:
+                if not self._put(loop, ('log', lines)):
+                    return
+        except Exception as e:
+            if not self._log_stream.closed:
+                logging.exception(f"Error reading pod log: {e}")
+                self._put(loop, ('log_error', [str(e)]))
+        self._put(loop, None)
+
+    def _put(self, loop, item):
+        # Blocks while the queue is full so a slow client slows down the reading of the log
+        async def put():
+            await self._queue.put(item)
+        future = asyncio.run_coroutine_threadsafe(put(), loop)
+        while True:
+            try:
+                future.result(timeout=1)
+                return True
+            except concurrent.futures.TimeoutError:
+                if self._log_stream.closed:
+                    future.cancel()
+                    return False
+
+class AnalysisStatusStreamHandler(tornado.web.RequestHandler): #pylint: disable=abstract-method
+    """
+    Server-sent events stream of the analysis_status notifications (see dbnotify.py), each
+    notification is a 'status' event with the json payload of the trigger, 'resync' means reload.
+    """
+
+    async def get(self):
+        """Handles GET requests.
+        """
+        notifier = dbnotify.get_analysis_status_notifier()
+        queue = notifier.subscribe()
+
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+
+        try:
+            while True:
+                try:
+                    payload = await queue.get(timeout=datetime.timedelta(seconds=30))
+                except tornado.util.TimeoutError:
+                    # comment line, keeps proxies from closing an idle stream
+                    self.write(": keepalive\n\n")
+                    await self.flush()
+                    continue
+
+                if payload == dbnotify.Notifier.RESYNC:
+                    self.write("event: resync\ndata: \n\n")
+                else:
+                    self.write(f"event: status\ndata: {payload}\n\n")
+                await self.flush()
+        except tornado.iostream.StreamClosedError:
+            logging.debug("Client closed analysis status stream")
+        finally:
+            notifier.unsubscribe(queue)
+
+class JobLogPageHandler(tornado.web.RequestHandler): #pylint: disable=abstract-method
+
+    def get(self, job_name):
+        """Handles GET requests.
+        """
+        self.render('joblog.html', job_name=job_name)
+
 class UpdateMetaQueryHandler(tornado.web.RequestHandler): #pylint: disable=abstract-method
 
     """
     The query handler handles form posts and returns list of results
     """
-    def post(self):
+    async def post(self):
         """Handles POST requests.
         """
 
@@ -185,7 +488,7 @@ class UpdateMetaQueryHandler(tornado.web.RequestHandler): #pylint: disable=abstr
 
         logging.debug("meta:" + str(meta))
 
-        result = dbqueries.update_analysis_meta(id, meta)
+        result = await run_blocking(dbqueries.update_analysis_meta, id, meta)
 
         self.finish({'result':result})
 
@@ -199,11 +502,17 @@ class DeleteAnalysisQueryHandler(tornado.web.RequestHandler): #pylint: disable=a
         body = "application/json"
         self.set_header(header, body)
 
-    def get(self, id):
+    async def get(self, id):
         """Handles GET requests.
         """
         logging.info("id: " + str(id))
 
+        result = await run_blocking(self._delete_analysis, id)
+
+        logging.debug(result)
+        self.finish({'result':result})
+
+    def _delete_analysis(self, id):
         # Attempt to cancel HPC jobs on Pelle by extracting job ids from status/meta
         scancel_info = None
         try:
@@ -257,14 +566,13 @@ class DeleteAnalysisQueryHandler(tornado.web.RequestHandler): #pylint: disable=a
         if scancel_info is not None:
             result.append({"pelle_scancel": scancel_info})
 
-        logging.debug(result)
-        self.finish({'result':result})
+        return result
 
 class RunAnalysisQueryHandler(tornado.web.RequestHandler): #pylint: disable=abstract-method
     """
     The query handler handles form posts and returns list of results
     """
-    def post(self):
+    async def post(self):
         """Handles POST requests.
         """
 
@@ -293,6 +601,7 @@ class RunAnalysisQueryHandler(tornado.web.RequestHandler): #pylint: disable=abst
         run_on_pelle = ("on" == self.get_argument("run-pelle-cbx", default="off"))
         run_on_hpcdev = ("on" == self.get_argument("run-hpcdev-cbx", default="off"))
         run_location = self.get_argument("run-location", default="uppmax")
+        allow_duplicates = ("on" == self.get_argument("allow-duplicates-cbx", default="off"))
 
         logging.info(f"run_on_uppmax: {run_on_uppmax}")
         logging.info(f"run_on_pelle: {run_on_pelle}")
@@ -303,30 +612,30 @@ class RunAnalysisQueryHandler(tornado.web.RequestHandler): #pylint: disable=abst
         logging.info(f"priority: {priority}")
 
         plate_acqs_list = pipelineutils.parse_string_of_num_and_ranges(plate_acq_input)
-        for plate_acquisition in plate_acqs_list:
-            results = dbqueries.submit_analysis(plate_acquisition,
-                                                analysis_pipeline_name,
-                                                cellprofiler_version,
-                                                well_filter,
-                                                site_filter,
-                                                z_plane,
-                                                priority,
-                                                run_on_uppmax,
-                                                run_on_pharmbio,
-                                                run_on_haswell,
-                                                run_on_pelle,
-                                                run_on_hpcdev,
-                                                run_location)
-            if results != "OK":
-                break
-        logging.debug(results)
-        self.finish({'results':results})
+        # All plates of a range are submitted in one transaction, either all or none
+        submitted = await run_blocking(dbqueries.submit_analyses,
+                                       plate_acqs_list,
+                                       analysis_pipeline_name,
+                                       cellprofiler_version,
+                                       well_filter,
+                                       site_filter,
+                                       z_plane,
+                                       priority,
+                                       run_on_uppmax,
+                                       run_on_pharmbio,
+                                       run_on_haswell,
+                                       run_on_pelle,
+                                       run_on_hpcdev,
+                                       run_location,
+                                       allow_duplicates=allow_duplicates)
+        logging.debug(submitted)
+        self.finish({'results':"OK", 'analyses':submitted})
 
 class CloneAnalysisQueryHandler(tornado.web.RequestHandler): #pylint: disable=abstract-method
     """
     The query handler handles form posts and returns list of results
     """
-    def post(self):
+    async def post(self):
         """Handles POST requests.
         """
 
@@ -343,20 +652,20 @@ class CloneAnalysisQueryHandler(tornado.web.RequestHandler): #pylint: disable=ab
 
         #logging.debug("form_data:" + str(form_data))
 
+        allow_duplicates = ("on" == self.get_argument("allow-duplicates-cbx", default="off"))
+
         plate_acqs_list = pipelineutils.parse_string_of_num_and_ranges(plate_acq_input)
-        for plate_acquisition in plate_acqs_list:
-            results = dbqueries.submit_analysis(plate_acquisition, analysis_pipeline_name, cellprofiler_version, well_filter, site_filter)
-            if results != "OK":
-                break
-        logging.debug(results)
-        self.finish({'results':results})
+        submitted = await run_blocking(dbqueries.submit_analyses, plate_acqs_list, analysis_pipeline_name, cellprofiler_version, well_filter, site_filter,
+                                       allow_duplicates=allow_duplicates)
+        logging.debug(submitted)
+        self.finish({'results':"OK", 'analyses':submitted})
 
 
 class SaveAnalysisPipelinesQueryHandler(tornado.web.RequestHandler): #pylint: disable=abstract-method
     """
     The query handler handles form posts and returns list of results
     """
-    def post(self):
+    async def post(self):
         """Handles POST requests.
         """
 
@@ -366,19 +675,20 @@ class SaveAnalysisPipelinesQueryHandler(tornado.web.RequestHandler): #pylint: di
         meta = self.get_argument("analysis_pipeline-meta")
         name = self.get_argument("analysis_pipeline-name")
 
-        verification = pipelineutils.veify_analysis_pipeline_meta(meta)
+        verification = await run_blocking(pipelineutils.veify_analysis_pipeline_meta, meta)
         if verification != 'OK':
             results = verification
         else:
-            results = dbqueries.save_analysis_pipelines(name, meta)
+            results = await run_blocking(dbqueries.save_analysis_pipelines, name, meta)
 
         self.finish({'results':results})
 
 
 class SaveImgsetQueryHandler(tornado.web.RequestHandler):
-    def post(self):
+    async def post(self):
         logging.info("%r %s", self.request, self.request.body.decode())
 
+        acq_ids, well_filters, site_filters = None, None, None
         try:
 
             multi_filter_input = self.get_argument("multi_filter-input").strip()
@@ -408,9 +718,39 @@ class SaveImgsetQueryHandler(tornado.web.RequestHandler):
         use_icf = include_icf == "on"
         icf_path = None if not use_icf else "/cpp_work/devel/icf_npy/"
 
-        all_imgsets = {}
-        channel_map = None
+        selections = self._get_selections(multi_filters, acq_ids, well_filters, site_filters)
+
+        # The csv only changes when the request or the images of the acquisitions change
+        cache_key, etag = await run_blocking(cellprofiler_utils.get_imgset_etag, selections, use_icf, icf_path)
+        self.set_header("Etag", etag)
+        if self.check_etag_header():
+            self.set_status(304)
+            return
+
+        self.set_header("Content-type", "text/plain")
+
+        cached_csv = IMGSET_CSV_CACHE.get(cache_key, etag)
+        if cached_csv is not None:
+            logging.info("imgset csv served from cache")
+            self.write(cached_csv)
+            return
+
+        all_imgsets, channel_map = await run_blocking(self._fetch_imgsets, selections)
+
+        # Stream the csv to the client while it is generated and keep a copy for the cache
+        csv_chunks = []
+        def collect(chunks):
+            for chunk in chunks:
+                csv_chunks.append(chunk)
+                yield chunk
+
+        chunks = cellprofiler_utils.iter_cellprofiler_imgsets_csv(all_imgsets, channel_map, use_icf, icf_path)
+        await write_chunks(self, collect(chunks))
+        IMGSET_CSV_CACHE.put(cache_key, etag, "".join(csv_chunks))
+
+    def _get_selections(self, multi_filters, acq_ids, well_filters, site_filters):
         logging.info(f'multi {multi_filters}')
+        selections = []
         if multi_filters and len(multi_filters) > 0 and multi_filters != None:
             for filter in multi_filters:
                 parts = filter.split('_')
@@ -420,27 +760,26 @@ class SaveImgsetQueryHandler(tornado.web.RequestHandler):
                 # Check if site_filter exists; if not, set it to [None]
                 site_filters = [parts[2]] if len(parts) > 2 else [None]
 
-                imgsets = cellprofiler_utils.get_imgsets(acq_id, well_filters, site_filters)
-                all_imgsets.update(imgsets)
-
-                database = Database.get_instance()
-                channel_map = database.get_channel_map_from_acq_id(acq_id)
+                selections.append((acq_id, well_filters, site_filters))
 
         else:
             for acq_id in acq_ids:
-                # Fetch imgsets for each acq_id
-                imgsets = cellprofiler_utils.get_imgsets(acq_id, well_filters, site_filters)
-                all_imgsets.update(imgsets)
+                selections.append((acq_id, well_filters, site_filters))
 
-                database = Database.get_instance()
-                channel_map = database.get_channel_map_from_acq_id(acq_id)
+        return selections
 
-        logging.info(f"{all_imgsets}")
+    def _fetch_imgsets(self, selections):
+        # One image query and one channel map query for all acquisitions
+        all_imgsets, channel_maps = cellprofiler_utils.get_imgsets_for_acquisitions(selections)
 
-        imgset_csv = cellprofiler_utils.get_cellprofiler_imgsets_csv(all_imgsets, channel_map, use_icf, icf_path)
+        # The csv has one set of channel columns, use the channel map of the last acquisition as before
+        channel_map = channel_maps[int(selections[-1][0])]
+        if any(other_map != channel_map for other_map in channel_maps.values()):
+            logging.warning(f"Plate acquisitions have different channel maps, using the one of acq_id {selections[-1][0]}")
 
-        self.set_header("Content-type", "text/plain")
-        self.write(imgset_csv)
+        logging.info(f"imgsets: {len(all_imgsets)}")
+
+        return all_imgsets, channel_map
 
     def get(self):
         """Handles GET requests.
@@ -474,12 +813,12 @@ class ListAnalysisPipelinesQueryHandler(tornado.web.RequestHandler): #pylint: di
         body = "application/json"
         self.set_header(header, body)
 
-    def get(self, name):
+    async def get(self, name):
         """Handles GET requests.
         """
         logging.info("name: " + str(name))
 
-        result = dbqueries.list_analysis_pipelines()
+        result = await run_blocking(dbqueries.list_analysis_pipelines)
 
         logging.debug(result)
         self.finish({'result':result})
@@ -487,18 +826,18 @@ class ListAnalysisPipelinesQueryHandler(tornado.web.RequestHandler): #pylint: di
 
 class LogHandler(tornado.web.RequestHandler):  # pylint: disable=abstract-method
 
-    def get(self, analysis_id):
+    async def get(self, analysis_id):
         """Handles GET requests."""
 
         logging.info(f"LogHandler, id: {analysis_id}")
 
-        log_msg = self._create_log_message(analysis_id)
+        # Only the analysis header is rendered here, the page fetches the sub analyses from SubAnalysisLogHandler
+        log_msg = await run_blocking(self._create_log_message, analysis_id)
 
         log_msg = f"{log_msg}"
 
-        log_msg = self._highlight_error(log_msg)
-
-        self.render('log.html', log_msg=log_msg)
+        self.render('log.html', log_msg=log_msg, analysis_id=analysis_id,
+                    page_size=pipelinegui_settings.LOG_SUB_ANALYSES_PAGE_SIZE)
 
     def _create_log_message(self, analysis_id):
         analysis_info = dbqueries.select_image_analyses(analysis_id)
@@ -506,16 +845,11 @@ class LogHandler(tornado.web.RequestHandler):  # pylint: disable=abstract-method
         if isinstance(analysis_info, list) and len(analysis_info) > 0:
             analysis_info = analysis_info[0]  # Access the first dictionary in the list
         else:
-            raise ValueError(f"No analysis found for ID {analysis_id}")
-        sub_analyses = dbqueries.select_image_sub_analyses(analysis_id)
+            raise tornado.web.HTTPError(404, f"No analysis found for ID {analysis_id}")
 
         log_msg = f"result_path: /cpp_work/results/{analysis_info['plate_barcode']}/{analysis_info['plate_acquisition_id']}/{analysis_info['id']}"
         log_msg += "<br><br>"
 
-        for sub in sub_analyses:
-            msg = self._create_sub_log_message(sub)
-            log_msg += f"{msg}<br><br>"
-
         return log_msg
 
     def _create_sub_log_message(self, sub):
@@ -538,16 +872,21 @@ class LogHandler(tornado.web.RequestHandler):  # pylint: disable=abstract-method
         pretty_meta = json.dumps(sub['meta'], indent=2)
         msg.append(f"meta:<pre>{pretty_meta}</pre>")
 
+        # Highlighting is done on the (small) parts shown, not on the whole page
+        msg = [self._highlight_error(line) for line in msg]
+
         # If an "error" file exists directly in the output directory, display its contents
         try:
             top_error_file = os.path.join(out_path, "error")
             if os.path.isfile(top_error_file):
-                top_error_content = self._read_file_to_string(top_error_file)
-                msg.append(f"error file content:<pre>{top_error_content}</pre>")
+                top_error_content = self._read_file_preview(top_error_file)
+                msg.append(f"error file content:{top_error_content}")
         except Exception as e:
             logging.error(f"Failed reading top-level error file in {out_path}: {e}")
 
-        error_paths = self._get_error_job_paths(out_path, 10)
+        # Job statuses are kept in an index, only new job directories are read
+        sub_finished = sub['finish'] is not None or sub['error'] is not None
+        error_paths = fileutils.get_error_job_paths(id, out_path, sub_finished, 10)
 
         header_added = False
         for path in error_paths:
@@ -557,13 +896,13 @@ class LogHandler(tornado.web.RequestHandler):  # pylint: disable=abstract-method
             msg.append(f"job_path: {path}<br>")
 
             log_file = os.path.join(path, "cp.log")
-            log_file_content = self._read_file_to_string(log_file)
-            msg.append(f"cellprofiler log:<pre>{log_file_content}</pre>")
+            log_file_content = self._read_file_preview(log_file)
+            msg.append(f"cellprofiler log:{log_file_content}")
 
             input_csv_path = self._get_input_csv_path_from_out_path(path)
-            input_csv = self._read_file_to_string(input_csv_path)
+            input_csv = self._read_file_preview(input_csv_path)
             # TODO pretty print this
-            msg.append(f"input.csv:<pre>{input_csv}</pre>")
+            msg.append(f"input.csv:{input_csv}")
 
             msg.append("###################################################################################################################<br>")
 
@@ -597,27 +936,6 @@ class LogHandler(tornado.web.RequestHandler):  # pylint: disable=abstract-method
 
         return None
 
-    def _get_error_job_paths(self, sub_out_path, limit=10):
-        root = sub_out_path
-        error_paths = []
-        try:
-            # List the first-level subdirectories
-            subdirs = [os.path.join(root, subdir) for subdir in os.listdir(root) if os.path.isdir(os.path.join(root, subdir))]
-
-            # Check each subdirectory for the "error" file
-            for subdir in subdirs:
-                error_file_path = os.path.join(subdir, "error")
-                if os.path.isfile(error_file_path):
-                    error_paths.append(subdir)
-
-                    # Break if we have reached the limit
-                    if len(error_paths) >= limit:
-                        break
-        except Exception as e:
-            logging.error(f"An error occurred while fetching error job paths: {e}")
-
-        return error_paths
-
     def _get_input_csv_path_from_out_path(self, output_path):
         # Split the output path into parts
         path_parts = output_path.split('/')
@@ -630,29 +948,77 @@ class LogHandler(tornado.web.RequestHandler):  # pylint: disable=abstract-method
 
         return new_path
 
-    def _read_file_to_string(self, file_path):
+    def _read_file_preview(self, file_path):
         """
-        Reads the content of the specified file and returns it as a string.
-
-        :param file_path: Path to the file to be read
-        :return: Content of the file as a string, or None if an error occurs
+        Head and tail of a file as html, at most LOG_HEAD_BYTES + LOG_TAIL_BYTES are read. The part in
+        between is left out with a "load more" link, which fetches it in Range requests from /cpp_work/.
         """
         try:
-            with open(file_path, 'r') as file:
-                content = file.read()
-            return content
+            preview = fileutils.read_file_head_tail(file_path, pipelinegui_settings.LOG_HEAD_BYTES,
+                                                    pipelinegui_settings.LOG_TAIL_BYTES)
         except FileNotFoundError:
             logging.error(f"The file {file_path} does not exist.")
-            return None
+            return "<pre>None</pre>"
         except Exception as e:
             logging.error(f"An error occurred while reading the file {file_path}: {e}")
-            return None
+            return "<pre>None</pre>"
+
+        head = self._highlight_error(tornado.escape.xhtml_escape(preview['head']))
+        if preview['tail'] is None:
+            return f"<pre>{head}</pre>"
+
+        tail = self._highlight_error(tornado.escape.xhtml_escape(preview['tail']))
+        omitted = preview['tail_start'] - preview['head_end']
+        url = tornado.escape.xhtml_escape(self._get_static_url(file_path))
+        load_more = (f"<a href='#' class='load-more' data-url='{url}' data-start='{preview['head_end']}' "
+                     f"data-end='{preview['tail_start']}' data-chunk='{pipelinegui_settings.LOG_HEAD_BYTES}'>"
+                     f"... {omitted} bytes not shown, load more</a>")
+        return f"<pre>{head}</pre>{load_more}<pre>{tail}</pre>"
+
+    def _get_static_url(self, file_path):
+        # files below STATIC_CPP_DIR are served by the /cpp_work/ StaticFileHandler, which supports Range
+        relative_path = os.path.relpath(file_path, pipelinegui_settings.STATIC_CPP_DIR)
+        return "/cpp_work/" + urllib.parse.quote(relative_path)
 
     def _highlight_error(self, log_msg):
         # Use re.sub to find case insensitive "error" and replace with <span class="highlight-error"></span>
         highlighted_msg = re.sub(r'(?i)error', r'<span class="highlight-error">\g<0></span>', log_msg)
         return highlighted_msg
 
+class SubAnalysisLogHandler(LogHandler):  # pylint: disable=abstract-method
+    """
+    Log sections of a page of the sub analyses of an analysis as json, arguments offset and limit
+    (at most LOG_SUB_ANALYSES_PAGE_SIZE). The sections are built concurrently in LOG_SECTION_EXECUTOR,
+    each one reads files of its own output dir.
+    """
+
+    def prepare(self):
+        header = "Content-Type"
+        body = "application/json"
+        self.set_header(header, body)
+
+    async def get(self, analysis_id):
+        """Handles GET requests."""
+        try:
+            offset = int(self.get_argument("offset", 0))
+            limit = int(self.get_argument("limit", pipelinegui_settings.LOG_SUB_ANALYSES_PAGE_SIZE))
+        except ValueError:
+            raise tornado.web.HTTPError(400, "offset and limit must be integers")
+        limit = max(1, min(limit, pipelinegui_settings.LOG_SUB_ANALYSES_PAGE_SIZE))
+
+        # one extra row tells if there is a next page
+        sub_analyses = await run_blocking(dbqueries.select_image_sub_analyses_page, analysis_id, offset, limit + 1)
+        has_more = len(sub_analyses) > limit
+        sub_analyses = sub_analyses[:limit]
+
+        loop = IOLoop.current()
+        sections = await asyncio.gather(*(loop.run_in_executor(LOG_SECTION_EXECUTOR, self._create_sub_log_message, sub)
+                                          for sub in sub_analyses))
+
+        result = [{'sub_id': sub['sub_id'], 'html': section} for sub, section in zip(sub_analyses, sections)]
+        next_offset = offset + len(result) if has_more else None
+        self.finish({'result':result, 'next_offset':next_offset})
+
 IMAGE_EXTENSIONS = (".tif", ".tiff", ".png", ".jpg", ".jpeg", ".bmp")
 def get_image_files(base_dir, limit):
     image_files = []
@@ -671,25 +1037,87 @@ def drawImages(images):
 
     for image in images:
 
+        # previews from the thumbnail cache, the full size image is behind the link
+        relative_path = os.path.relpath(image, pipelinegui_settings.STATIC_CPP_DIR)
+        thumbnail_url = f'/thumbnail/{urllib.parse.quote(relative_path)}?width=1000'
+
         out.append('<br>')
         out.append(f'{os.path.basename(image)}')
         out.append('<br>')
-        out.append(f'<img src="{image}" alt="{image}" width=1000 />')
+        out.append(f'<a href="{image}" target="_blank"><img src="{thumbnail_url}" alt="{image}" width=1000 loading="lazy" /></a>')
         out.append('<br>')
 
     return "".join(out)
 
 
-class SegmentationHandler(tornado.web.RequestHandler): #pylint: disable=abstract-method
+class ThumbnailHandler(tornado.web.RequestHandler): #pylint: disable=abstract-method
+    """
+    Downsampled preview of an image below STATIC_CPP_DIR, arguments width and format (jpeg or webp)
+    """
 
-    def get(self, analysis_id):
+    async def get(self, path):
         """Handles GET requests.
         """
+        fmt = self.get_argument("format", "jpeg").lower()
+        if fmt not in thumbnails.FORMATS:
+            raise tornado.web.HTTPError(400, f"format must be one of {', '.join(thumbnails.FORMATS)}")
+        try:
+            width = int(self.get_argument("width", 500))
+        except ValueError:
+            raise tornado.web.HTTPError(400, "width must be an integer")
+        width = min(max(width, thumbnails.MIN_WIDTH), thumbnails.MAX_WIDTH)
 
-        limit = 20
+        # only images below the served /cpp_work/ directory
+        root = os.path.realpath(pipelinegui_settings.STATIC_CPP_DIR)
+        image_path = os.path.realpath(os.path.join(root, path))
+        if not image_path.startswith(root + os.sep) or not image_path.lower().endswith(IMAGE_EXTENSIONS):
+            raise tornado.web.HTTPError(403)
+
+        try:
+            # the key only needs a stat of the image, a client with the current thumbnail gets 304
+            # without generating or reading it
+            thumbnail_path, key = await run_blocking(thumbnails.get_thumbnail_path, image_path, width, fmt)
+            self.set_header("Content-Type", thumbnails.FORMATS[fmt])
+            self.set_header("Cache-Control", "max-age=86400")
+            self.set_header("Etag", f'"{key}"')
+            if self.check_etag_header():
+                self.set_status(304)
+                return
+
+            await thumbnails.get_thumbnail(image_path, thumbnail_path, width, fmt, EXECUTOR)
+            # the thumbnail can be evicted between generation and reading, then it is made again
+            try:
+                data = await run_blocking(read_bytes, thumbnail_path)
+            except FileNotFoundError:
+                await thumbnails.get_thumbnail(image_path, thumbnail_path, width, fmt, EXECUTOR)
+                data = await run_blocking(read_bytes, thumbnail_path)
+        except FileNotFoundError:
+            raise tornado.web.HTTPError(404)
+
+        self.finish(data)
+
+def read_bytes(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+class SegmentationHandler(tornado.web.RequestHandler): #pylint: disable=abstract-method
+
+    async def get(self, analysis_id):
+        """Handles GET requests.
+        """
 
         logging.info(f"SegmentationHandler, id: {analysis_id}")
 
+        images = await run_blocking(self._find_images, analysis_id)
+
+        self.render('segmentation.html', analysis_id=analysis_id,
+                                         images=images)
+
+    def _find_images(self, analysis_id):
+
+        limit = 20
+
         logging.info(f"Limit, id: {analysis_id}")
 
         analysis_info = dbqueries.select_image_analyses(analysis_id)
@@ -731,6 +1159,4 @@ class SegmentationHandler(tornado.web.RequestHandler): #pylint: disable=abstract
 
         logging.info(f"images {images}")
 
-
-        self.render('segmentation.html', analysis_id=analysis_id,
-                                         images=images)
+        return images
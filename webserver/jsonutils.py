@@ -0,0 +1,32 @@
+import datetime
+import decimal
+import json
+import uuid
+
+
+def default_serializer(obj):
+    """JSON serializer for objects not serializable by default json code"""
+
+    if isinstance(obj, (datetime.date, datetime.datetime, datetime.time)):
+        return obj.isoformat()
+
+    if isinstance(obj, datetime.timedelta):
+        return str(obj)
+
+    # numeric columns, as a string so no precision is lost
+    if isinstance(obj, decimal.Decimal):
+        return str(obj)
+
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+
+    # other database types (e.g. ranges, inet), a listing should not fail on one column
+    return str(obj)
+
+
+# One shared encoder, compact separators since the output is only read by the browser
+ENCODER = json.JSONEncoder(default=default_serializer, separators=(',', ':'))
+
+
+def dumps(obj):
+    return ENCODER.encode(obj)
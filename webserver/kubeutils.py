@@ -1,5 +1,6 @@
 
 import kubernetes
+import kubernetes.watch
 from kubernetes import config, client
 from kubernetes.client.rest import ApiException
 import logging
@@ -7,6 +8,12 @@ import os
 import yaml
 import base64
 import datetime
+import threading
+
+import settings as pipelinegui_settings
+
+# Seconds list_jobs waits for the first listing of the job cache
+JOB_CACHE_SYNC_TIMEOUT = 30
 
 
 def is_develop():
@@ -36,99 +43,349 @@ def get_namespace():
     return "cpp"
 
 
+_api_client = None
+_batch_api = None
+_core_api = None
+_api_client_lock = threading.Lock()
+
 def init_kubernetes_connection():
     """
     Initialize Kubernetes client using the in-cluster service account.
 
     This assumes the application is running inside a Kubernetes cluster with
     a ServiceAccount that has the required RBAC permissions.
+    Returns an ApiClient with a pooled http connection of K8S_POOL_SIZE connections.
     """
-    config.load_incluster_config()
-    logging.info("Loaded in-cluster service account configuration")
-    
+    configuration = client.Configuration()
+    config.load_incluster_config(client_configuration=configuration)
+    configuration.connection_pool_maxsize = pipelinegui_settings.K8S_POOL_SIZE
+    logging.info(f"Loaded in-cluster service account configuration, K8s client talking to: {configuration.host}")
+    return client.ApiClient(configuration)
 
-def list_jobs():
-    # list all jobs in namespace
-    namespace = get_namespace()
 
-    init_kubernetes_connection()
+def set_api_client(api_client):
+    """
+    Replace the process wide ApiClient, e.g. with one pointing at a local stub server in tests.
+    None means it is created again from the in-cluster configuration on next use.
+    The job cache is stopped, the next get_job_cache lists and watches with the new client.
+    """
+    global _api_client, _batch_api, _core_api, _job_cache
+    with _api_client_lock:
+        _api_client = api_client
+        _batch_api = None
+        _core_api = None
 
-     # DEBUG: print out what host we're pointing at
-    host = client.Configuration().host
-    logging.info(f"K8s client talking to: {host}")
-    
+    # not under _api_client_lock, get_job_cache takes the locks in the other order
+    with _job_cache_lock:
+        if _job_cache is not None:
+            _job_cache.stop()
+            _job_cache = None
 
-    k8s_batch_api = client.BatchV1Api()
 
-    try:
-        job_list = k8s_batch_api.list_namespaced_job(namespace=namespace)
-    except ApiException as e:
-        # bubble up a structured error instead of HTML
-        raise RuntimeError(f"Kubernetes API error [{e.status}]: {e.reason}")
+def get_api_client():
+    """
+    The process wide ApiClient, created on first use
+    """
+    global _api_client
+    with _api_client_lock:
+        if _api_client is None:
+            _api_client = init_kubernetes_connection()
+        return _api_client
 
-    # filter out all finished jobs
-    rows = [["NAME", "ACTIVE", "SUCCEEDED", "FAILED", "CREATED", "STARTED", "FINISHED", "DURATION", "AGE", "STATUS"]]
-    for job in job_list.items:
 
-        # logging.debug(job)
+def get_batch_api():
+    global _batch_api
+    api_client = get_api_client()
+    with _api_client_lock:
+        if _batch_api is None:
+            _batch_api = client.BatchV1Api(api_client)
+        return _batch_api
 
-        row = []
 
-        # convert to dict for usability
-        job_dict = job.to_dict()
+def get_core_api():
+    global _core_api
+    api_client = get_api_client()
+    with _api_client_lock:
+        if _core_api is None:
+            _core_api = client.CoreV1Api(api_client)
+        return _core_api
 
-        #logging.debug("Job:" + str(job))
-        # logging.debug(job.metadata.cluster_name)
 
-        # metadata, spec, status
+class JobCache:
+    """
+    Informer style local copy of the jobs in a namespace.
 
-        # name
-        name = job.metadata.name
+    A background thread does one paged list of the jobs and then watches for changes from the
+    resourceVersion of the list. When the watch times out it is restarted from the last seen
+    resourceVersion, when the resourceVersion has expired (410 Gone) the jobs are listed again.
+    The jobs are indexed by name, analysis_id label and status so listings are served from memory.
 
-        # active
-        active = int(job.status.active or 0)
+    batch_api and watch_factory can be replaced with fakes in tests, watch_factory() must return an
+    object with a stream(func, **kwargs) method yielding {'type': ..., 'object': ...} events.
+    """
 
-        # succeeded
-        succeeded = int(job.status.succeeded or 0)
+    def __init__(self, namespace, batch_api=None, watch_factory=None, page_size=500, watch_timeout=300, retry_delay=5):
+        self.namespace = namespace
+        self.batch_api = batch_api
+        self.watch_factory = watch_factory or kubernetes.watch.Watch
+        self.page_size = page_size
+        self.watch_timeout = watch_timeout
+        self.retry_delay = retry_delay
+
+        self.resource_version = None
+        self._jobs = {}
+        self._by_analysis_id = {}
+        self._by_status = {}
+        self._version = 0
+        self._stats = None
+        self._stats_version = None
+        self._lock = threading.Lock()
+        self._synced = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="job-cache", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+
+    def wait_until_synced(self, timeout=None):
+        return self._synced.wait(timeout)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                if self.resource_version is None:
+                    self._relist()
+                self._watch()
+            except ApiException as e:
+                if e.status == 410:
+                    logging.info("Job watch resourceVersion expired, relisting jobs")
+                    self.resource_version = None
+                else:
+                    logging.error(f"Job watch failed, Kubernetes API error [{e.status}]: {e.reason}")
+                    self.resource_version = None
+                    self._stopped.wait(self.retry_delay)
+            except Exception as e:
+                logging.exception(f"Job watch failed: {e}")
+                self.resource_version = None
+                self._stopped.wait(self.retry_delay)
+
+    def _relist(self):
+        jobs = {}
+        continue_token = None
+        while True:
+            kwargs = {'limit': self.page_size}
+            if continue_token:
+                kwargs['_continue'] = continue_token
+            job_list = self.batch_api.list_namespaced_job(self.namespace, _request_timeout=pipelinegui_settings.K8S_REQUEST_TIMEOUT, **kwargs)
+            for job in job_list.items:
+                jobs[job.metadata.name] = job_summary(job)
+
+            continue_token = job_list.metadata._continue
+            if not continue_token:
+                break
+
+        with self._lock:
+            self._jobs = {}
+            self._by_analysis_id = {}
+            self._by_status = {}
+            for job in jobs.values():
+                self._add(job)
+
+        self.resource_version = job_list.metadata.resource_version
+        self._synced.set()
+        logging.info(f"Job cache listed {len(jobs)} jobs, resourceVersion {self.resource_version}")
+
+    def _watch(self):
+        watch = self.watch_factory()
+        # timeout_seconds ends the watch on the server, the read timeout a bit later ends a watch
+        # on a dead connection that would otherwise block the thread forever
+        request_timeout = (pipelinegui_settings.K8S_REQUEST_TIMEOUT,
+                           self.watch_timeout + pipelinegui_settings.K8S_REQUEST_TIMEOUT)
+        for event in watch.stream(self.batch_api.list_namespaced_job, namespace=self.namespace,
+                                  resource_version=self.resource_version,
+                                  timeout_seconds=self.watch_timeout,
+                                  allow_watch_bookmarks=True,
+                                  _request_timeout=request_timeout):
+            if self._stopped.is_set():
+                watch.stop()
+                return
+
+            event_type = event['type']
+            job = event['object']
+
+            if event_type == 'ERROR':
+                # e.g. a 410 Gone status object when the resourceVersion is too old
+                status = event.get('raw_object', {}).get('code')
+                raise ApiException(status=status, reason="Watch error event")
+
+            if event_type != 'BOOKMARK':
+                summary = job_summary(job)
+                with self._lock:
+                    self._remove(summary['name'])
+                    if event_type in ('ADDED', 'MODIFIED'):
+                        self._add(summary)
+
+            self.resource_version = job.metadata.resource_version
+
+    def _add(self, job):
+        self._version += 1
+        self._jobs[job['name']] = job
+        self._by_analysis_id.setdefault(job['analysis_id'], set()).add(job['name'])
+        self._by_status.setdefault(job['status'], set()).add(job['name'])
+
+    def _remove(self, name):
+        old = self._jobs.pop(name, None)
+        if old is not None:
+            self._version += 1
+            self._by_analysis_id[old['analysis_id']].discard(name)
+            self._by_status[old['status']].discard(name)
+
+    def get_job(self, name):
+        with self._lock:
+            return self._jobs.get(name)
+
+    def get_jobs(self, analysis_id=None, status=None):
+        """
+        Job summaries, optionally only the ones with an analysis_id label and/or a status
+        """
+        with self._lock:
+            names = None
+            if analysis_id is not None:
+                names = set(self._by_analysis_id.get(str(analysis_id), ()))
+            if status is not None:
+                status_names = self._by_status.get(status, set())
+                names = set(status_names) if names is None else names & status_names
+            if names is None:
+                return list(self._jobs.values())
+            return [self._jobs[name] for name in names]
+
+    def get_stats(self):
+        """
+        Job counts in total, per status and per analysis_id label, recomputed only when a job has changed
+        """
+        with self._lock:
+            if self._stats_version != self._version:
+                self._stats = compute_job_stats(self._jobs.values())
+                self._stats_version = self._version
+            return self._stats
+
+
+def count_jobs(jobs):
+    # active, succeeded and failed are pod counts of the jobs, as in the job table
+    counts = {'total': 0, 'active': 0, 'succeeded': 0, 'failed': 0}
+    for job in jobs:
+        counts['total'] += 1
+        counts['active'] += job['active']
+        counts['succeeded'] += job['succeeded']
+        counts['failed'] += job['failed']
+    counts['queued'] = max(counts['total'] - counts['active'] - counts['succeeded'] - counts['failed'], 0)
+    return counts
+
+
+def compute_job_stats(jobs):
+    by_status = {}
+    by_analysis_id = {}
+    for job in jobs:
+        by_status.setdefault(job['status'], []).append(job)
+        if job['analysis_id'] is not None:
+            by_analysis_id.setdefault(job['analysis_id'], []).append(job)
+
+    analyses = {}
+    for analysis_id, analysis_jobs in by_analysis_id.items():
+        counts = count_jobs(analysis_jobs)
+        done = sum(1 for job in analysis_jobs if job['status'] in ('Complete', 'Failed'))
+        counts['progress'] = round(done / counts['total'], 3)
+        analyses[analysis_id] = counts
+
+    return {'jobs': count_jobs(jobs),
+            'by_status': {status: len(status_jobs) for status, status_jobs in by_status.items()},
+            'by_analysis_id': analyses}
+
+
+def job_summary(job):
+    """
+    The parts of a V1Job that are used by the gui, kept in the JobCache instead of the whole object
+    """
+    labels = job.metadata.labels or {}
+    status = job.status
 
-        # failed
-        failed = int(job.status.failed or 0)
+    # Job status
+    if status is not None and status.conditions is not None and len(status.conditions) > 0:
+        job_status = status.conditions[0].type
+    else:
+        job_status = "None"
 
-        # created
-        created = job.metadata.creation_timestamp
+    return {
+        'name': job.metadata.name,
+        'analysis_id': labels.get('analysis_id'),
+        'active': int(status.active or 0) if status is not None else 0,
+        'succeeded': int(status.succeeded or 0) if status is not None else 0,
+        'failed': int(status.failed or 0) if status is not None else 0,
+        'created': job.metadata.creation_timestamp,
+        'started': status.start_time if status is not None else None,
+        'finished': status.completion_time if status is not None else None,
+        'status': job_status,
+    }
 
-        # start
-        started = job.status.start_time
 
-        # Finished
-        finished = job.status.completion_time
+_job_cache = None
+_job_cache_lock = threading.Lock()
 
-        # Duration
-        duration = getDuration(started, finished)
+def get_job_cache():
+    """
+    The process wide JobCache of the namespace, started on first use
+    """
+    global _job_cache
+    with _job_cache_lock:
+        if _job_cache is None:
+            _job_cache = JobCache(get_namespace(), batch_api=get_batch_api()).start()
+    return _job_cache
 
-        # Age
-        age = getAge(created)
 
-        # Job status
-        if job.status.conditions is not None and len(job.status.conditions) > 0:
-            status = job.status.conditions[0].type
-        else:
-            status = "None"
+def get_job_stats(analysis_id=None):
+    """
+    Precomputed job counts from the job cache, optionally only of one analysis_id
+    """
+    job_cache = get_job_cache()
+    if not job_cache.wait_until_synced(timeout=JOB_CACHE_SYNC_TIMEOUT):
+        raise RuntimeError("Kubernetes job cache not synced, could not count jobs")
 
+    stats = job_cache.get_stats()
+    if analysis_id is not None:
+        analysis_stats = stats['by_analysis_id'].get(str(analysis_id))
+        stats = dict(stats, by_analysis_id={str(analysis_id): analysis_stats} if analysis_stats else {})
+    return stats
 
-        row.append(name)
-        row.append(active)
-        row.append(succeeded)
-        row.append(failed)
-        row.append(str(created))
-        row.append(str(started))
-        row.append(str(finished))
-        row.append(str(duration))
-        row.append(str(age))
-        row.append(status)
 
-        rows.append(row)
+def list_jobs():
+    # list all jobs in namespace, from the local job cache
+    job_cache = get_job_cache()
+    if not job_cache.wait_until_synced(timeout=JOB_CACHE_SYNC_TIMEOUT):
+        raise RuntimeError("Kubernetes job cache not synced, could not list jobs")
 
+    rows = [["NAME", "ACTIVE", "SUCCEEDED", "FAILED", "CREATED", "STARTED", "FINISHED", "DURATION", "AGE", "STATUS"]]
+    for job in job_cache.get_jobs():
+
+        # Duration and age change over time, computed when listing
+        duration = getDuration(job['started'], job['finished'])
+        age = getAge(job['created'])
+
+        rows.append([job['name'],
+                     job['active'],
+                     job['succeeded'],
+                     job['failed'],
+                     str(job['created']),
+                     str(job['started']),
+                     str(job['finished']),
+                     str(duration),
+                     str(age),
+                     job['status']])
 
     return rows
 
@@ -163,35 +420,100 @@ def getAge(created):
 
 
 
-def get_job_log(job_name):
-
+def list_job_pods(job_name):
+    """
+    The pods of a job, oldest first
+    """
     namespace = get_namespace()
 
-    init_kubernetes_connection()
-    k8s_core_api = client.CoreV1Api()
+    k8s_core_api = get_core_api()
 
     label_selector = f"job-name={job_name}"
-    pods_list = k8s_core_api.list_namespaced_pod(namespace=namespace, label_selector=label_selector)
+    pods_list = k8s_core_api.list_namespaced_pod(namespace=namespace, label_selector=label_selector,
+                                                 _request_timeout=pipelinegui_settings.K8S_REQUEST_TIMEOUT)
+
+    pods = []
+    for pod in sorted(pods_list.items or [], key=lambda pod: pod.metadata.creation_timestamp):
+        pods.append({'name': pod.metadata.name,
+                     'phase': pod.status.phase if pod.status is not None else None,
+                     'created': str(pod.metadata.creation_timestamp)})
+    return pods
+
+
+def get_job_log(job_name, pod_name=None, tail_lines=None, since_seconds=None):
+
+    namespace = get_namespace()
+
+    k8s_core_api = get_core_api()
+
+    # Default is the first pod of the job
+    if pod_name is None:
+        pods = list_job_pods(job_name)
+        pod_name = pods[0]['name'] if len(pods) > 0 else None
 
-    # TODO in future one job could consist of many pods, but for now we only get log from first
     response = ""
-    if pods_list is not None and pods_list.items is not None and len(pods_list.items) > 0:
-        pod_name = pods_list.items[0].metadata.name
-        response = k8s_core_api.read_namespaced_pod_log(namespace=namespace, name=pod_name)
+    if pod_name is not None:
+        response = k8s_core_api.read_namespaced_pod_log(namespace=namespace, name=pod_name,
+                                                        tail_lines=tail_lines,
+                                                        since_seconds=since_seconds,
+                                                        _request_timeout=pipelinegui_settings.K8S_REQUEST_TIMEOUT)
     else:
         response = "Could not find a log, is pod started?"
 
     return str(response)
 
+
+class PodLogStream:
+    """
+    Log of a pod read as it is written, iterating gives lists of complete lines.
+
+    The http response is read without preloading so only the requested tail is transferred,
+    with follow=True the iteration ends when the container stops or close() is called.
+    close() may be called from another thread to stop a blocked read.
+    """
+
+    def __init__(self, pod_name, tail_lines=None, since_seconds=None, follow=True, chunk_size=8192):
+        # a read timeout would end a follow of a quiet pod, only the connect is limited
+        self.response = get_core_api().read_namespaced_pod_log(namespace=get_namespace(), name=pod_name,
+                                                               tail_lines=tail_lines,
+                                                               since_seconds=since_seconds,
+                                                               follow=follow,
+                                                               _preload_content=False,
+                                                               _request_timeout=(pipelinegui_settings.K8S_REQUEST_TIMEOUT, None))
+        self.chunk_size = chunk_size
+        self.closed = False
+
+    def __iter__(self):
+        partial = b""
+        try:
+            for chunk in self.response.stream(self.chunk_size):
+                if self.closed:
+                    return
+                lines = (partial + chunk).split(b"\n")
+                partial = lines.pop()
+                if lines:
+                    yield [line.decode("utf-8", errors="replace") for line in lines]
+            if partial and not self.closed:
+                yield [partial.decode("utf-8", errors="replace")]
+        finally:
+            self.close()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.response.close()
+            self.response.release_conn()
+
+
 def delete_analysis_jobs(analysis_id):
     # list all jobs in namespace
     namespace = get_namespace()
 
-    init_kubernetes_connection()
-    k8s_batch_api = client.BatchV1Api()
+    k8s_batch_api = get_batch_api()
 
     label_selector = f"analysis_id={analysis_id}"
-    response = k8s_batch_api.delete_collection_namespaced_job(namespace=namespace, label_selector=label_selector, propagation_policy='Foreground')
+    response = k8s_batch_api.delete_collection_namespaced_job(namespace=namespace, label_selector=label_selector, propagation_policy='Foreground',
+                                                              _request_timeout=pipelinegui_settings.K8S_REQUEST_TIMEOUT)
 
     logging.debug("delete_analysis_jobs, response: " + str(response))
 
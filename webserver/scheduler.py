@@ -0,0 +1,90 @@
+"""
+Dispatch order of the queued sub analyses: by priority first, then weighted fair share between
+the users (submitted_by) at the same priority, so one user's large range of plates does not
+starve everyone else.
+"""
+import heapq
+import math
+import time
+
+import dbqueries
+import settings as pipelinegui_settings
+
+# Sub analyses submitted without priority are dispatched after all with a priority
+NO_PRIORITY = math.inf
+
+
+def compute_dispatch_order(pending, running=None, weights=None, limit=None):
+    """
+    Order pending, (sub_id, analysis_id, priority, submitted_by) tuples ordered by sub_id, for dispatch.
+
+    Lower priority numbers go first. Within a priority the users are interleaved by weighted fair
+    queueing: the k-th sub analysis of a user gets the virtual time (running + k) / weight, where
+    running is the number of the user's sub analyses already started on the cluster. With equal
+    weights and nothing running this is a round robin between the users, a user with weight 2 gets
+    two slots per round, and a user who already occupies the cluster waits for the others.
+    Ties go to the oldest sub_id.
+
+    One pass to compute the keys and a heap select of the first limit rows (a sort without limit),
+    returns a list of (rank, sub_id, analysis_id, priority, submitted_by, virtual_time)
+    """
+    running = running or {}
+    weights = weights or {}
+
+    served = {}
+    keyed = []
+    for sub_id, analysis_id, priority, submitted_by in pending:
+        level = NO_PRIORITY if priority is None else priority
+        served_key = (level, submitted_by)
+        count = served.get(served_key)
+        if count is None:
+            count = running.get(submitted_by, 0)
+        count += 1
+        served[served_key] = count
+        virtual_time = count / weights.get(submitted_by, 1)
+        keyed.append((level, virtual_time, sub_id, analysis_id, priority, submitted_by))
+
+    if limit is not None and limit < len(keyed):
+        ordered = heapq.nsmallest(limit, keyed)
+    else:
+        ordered = sorted(keyed)
+
+    return [(rank, sub_id, analysis_id, priority, submitted_by, virtual_time)
+            for rank, (level, virtual_time, sub_id, analysis_id, priority, submitted_by) in enumerate(ordered, 1)]
+
+
+def get_dispatch_order(limit=100, submitted_by=None):
+    """
+    The dispatch order of the queued sub analyses in the database, the first limit entries (of
+    submitted_by only if given, with their rank in the full order) and a summary per user
+    """
+    pending, running = dbqueries.select_scheduler_state()
+
+    start = time.perf_counter()
+    weights = pipelinegui_settings.SCHEDULER_USER_WEIGHTS
+    ordered = compute_dispatch_order(pending, running, weights,
+                                     limit=None if submitted_by is not None else limit)
+    if submitted_by is not None:
+        ordered = [entry for entry in ordered if entry[4] == submitted_by][:limit]
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    users = {}
+    for sub_id, analysis_id, priority, user in pending:
+        if user not in users:
+            users[user] = {'pending': 0, 'running': running.get(user, 0), 'weight': weights.get(user, 1)}
+        users[user]['pending'] += 1
+    for user, count in running.items():
+        users.setdefault(user, {'pending': 0, 'running': count, 'weight': weights.get(user, 1)})
+
+    order = [{'rank': rank,
+              'sub_id': sub_id,
+              'analysis_id': analysis_id,
+              'priority': priority,
+              'submitted_by': user,
+              'virtual_time': round(virtual_time, 3)}
+             for rank, sub_id, analysis_id, priority, user, virtual_time in ordered]
+
+    return {'order': order,
+            'pending': len(pending),
+            'users': users,
+            'elapsed_ms': round(elapsed_ms, 1)}
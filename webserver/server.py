@@ -10,7 +10,8 @@ import tornado.web
 from tornado import autoreload, ioloop, log
 
 import handlers.query_handlers as query_handlers
-from database import Database
+import dbqueries
+import dbnotify
 import settings as pipelinegui_settings
 
 SETTINGS = {
@@ -48,7 +49,12 @@ ROUTES = [
           (r'/api/list/image_sub_analyses/(?P<limit>.+)', query_handlers.ListImageSubAnalysesHandler),
           (r'/api/list/jobs', query_handlers.ListJobsHandler),
           (r'/api/list/joblog/(?P<job_name>.+)', query_handlers.ListJobLogHandler),
+          (r'/api/list/jobpods/(?P<job_name>.+)', query_handlers.ListJobPodsHandler),
+          (r'/api/stream/joblog/(?P<job_name>.+)', query_handlers.JobLogStreamHandler),
+          (r'/api/stream/analysis_status', query_handlers.AnalysisStatusStreamHandler),
           (r'/api/list/pipelinefiles', query_handlers.ListPipelinefilesHandler),
+          (r'/api/stats/dbpool', query_handlers.DbPoolStatsHandler),
+          (r'/api/stats/jobs', query_handlers.JobStatsHandler),
           (r'/run-analysis.html', DefaultTemplateHandler),
           (r'/create-analysis.html', DefaultTemplateHandler),
           (r'/cellprofiler-devel.html', DefaultTemplateHandler),
@@ -59,8 +65,13 @@ ROUTES = [
           (r'/api/analysis-pipelines/(?P<name>.+)*', query_handlers.ListAnalysisPipelinesQueryHandler),
           (r'/api/analysis/delete/(?P<id>.+)', query_handlers.DeleteAnalysisQueryHandler),
           (r'/api/analysis/update_meta', query_handlers.UpdateMetaQueryHandler),
+          (r'/api/analysis/progress', query_handlers.AnalysesProgressHandler),
+          (r'/api/scheduler/order', query_handlers.SchedulerOrderHandler),
           (r'/log/(?P<analysis_id>.+)', query_handlers.LogHandler),
+          (r'/api/log/(?P<analysis_id>[0-9]+)/sub_analyses', query_handlers.SubAnalysisLogHandler),
+          (r'/joblog/(?P<job_name>.+)', query_handlers.JobLogPageHandler),
           (r'/segmentation/(?P<analysis_id>.+)', query_handlers.SegmentationHandler),
+          (r'/thumbnail/(?P<path>.+)', query_handlers.ThumbnailHandler),
           (r'/imgset', query_handlers.SaveImgsetQueryHandler),
           (r'/index.html', IndexTemplateHandler),
           (r'/', IndexTemplateHandler),
@@ -78,18 +89,14 @@ if __name__ == '__main__':
 
     logging.getLogger().setLevel(logging.INFO)
 
-    # Initialize Database connection pool
-    db_settings = {
-        "host": pipelinegui_settings.DB_HOSTNAME,
-        "port": pipelinegui_settings.DB_PORT,
-        "database": pipelinegui_settings.DB_NAME,
-        "user": pipelinegui_settings.DB_USER,
-        "password": pipelinegui_settings.DB_PASS,
-    }
-    Database.get_instance().initialize_connection_pool(**db_settings)
+    # Initialize Database connection pool, shared by all dbqueries and imgset queries
+    dbqueries.init_connection_pool()
 
     APP = tornado.web.Application(ROUTES, **SETTINGS)
     APP.listen(8080)
+
+    # Single listener connection for the analysis status notifications pushed to the browsers
+    dbnotify.get_analysis_status_notifier().start()
     try:
         ioloop.IOLoop.current().start()
     except KeyboardInterrupt:
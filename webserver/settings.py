@@ -12,8 +12,59 @@ with open(conf_file) as json_file:
   DB_NAME = os.getenv("DB_NAME", js_conf["DB_NAME"])
   DB_HOSTNAME = os.getenv("DB_HOSTNAME", js_conf["DB_HOSTNAME"])
 
+  # Connection pool shared by all handlers (see database.Database)
+  DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", js_conf.get("DB_POOL_MIN", 1)))
+  DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", js_conf.get("DB_POOL_MAX", 10)))
+  DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", js_conf.get("DB_POOL_TIMEOUT", 30)))
+  DB_POOL_PING_IDLE = float(os.getenv("DB_POOL_PING_IDLE", js_conf.get("DB_POOL_PING_IDLE", 30)))
+
+  # Worker threads for blocking DB, Kubernetes and NFS calls made by the request handlers
+  EXECUTOR_WORKERS = int(os.getenv("EXECUTOR_WORKERS", js_conf.get("EXECUTOR_WORKERS", 8)))
+
+  # Upper bound for the page size of the list endpoints
+  LIST_MAX_PAGE_SIZE = int(os.getenv("LIST_MAX_PAGE_SIZE", js_conf.get("LIST_MAX_PAGE_SIZE", 5000)))
+  # "python" or "postgres" (database builds the JSON of the list endpoints), see dbqueries.get_json_mode
+  LIST_JSON_MODE = os.getenv("LIST_JSON_MODE", js_conf.get("LIST_JSON_MODE", "python"))
+
+  # Memory limit of the in memory cache of generated imgset csv files
+  IMGSET_CACHE_MAX_BYTES = int(os.getenv("IMGSET_CACHE_MAX_BYTES", js_conf.get("IMGSET_CACHE_MAX_BYTES", 256 * 1024 * 1024)))
+
+  # Kubernetes client, http connections kept by the shared ApiClient and timeout (seconds) of each API request
+  K8S_POOL_SIZE = int(os.getenv("K8S_POOL_SIZE", js_conf.get("K8S_POOL_SIZE", 8)))
+  K8S_REQUEST_TIMEOUT = float(os.getenv("K8S_REQUEST_TIMEOUT", js_conf.get("K8S_REQUEST_TIMEOUT", 30)))
+
+  # Full rescan interval of the pipeline file index (seconds), inotify updates it in between where available
+  PIPELINE_INDEX_RESCAN_SECONDS = int(os.getenv("PIPELINE_INDEX_RESCAN_SECONDS", js_conf.get("PIPELINE_INDEX_RESCAN_SECONDS", 300)))
+
   ADMINER_URL = os.getenv("ADMINER_URL", js_conf["ADMINER_URL"])
 
   DEBUG = os.getenv("DEBUG", js_conf["DEBUG"])
 
   STATIC_CPP_DIR = os.getenv("STATIC_CPP_DIR", js_conf["STATIC_CPP_DIR"])
+
+  # Bytes shown of the start and the end of log, error and input files on the log page, the rest is loaded on demand
+  LOG_HEAD_BYTES = int(os.getenv("LOG_HEAD_BYTES", js_conf.get("LOG_HEAD_BYTES", 64 * 1024)))
+  LOG_TAIL_BYTES = int(os.getenv("LOG_TAIL_BYTES", js_conf.get("LOG_TAIL_BYTES", 64 * 1024)))
+
+  # Sub analyses per request of the lazily loaded log page
+  LOG_SUB_ANALYSES_PAGE_SIZE = int(os.getenv("LOG_SUB_ANALYSES_PAGE_SIZE", js_conf.get("LOG_SUB_ANALYSES_PAGE_SIZE", 10)))
+  # Worker threads building the sub analysis sections of the log page (NFS reads), shared by all log page views
+  LOG_SECTION_WORKERS = int(os.getenv("LOG_SECTION_WORKERS", js_conf.get("LOG_SECTION_WORKERS", 4)))
+
+  # Thumbnails of the segmentation page, worker processes, disk cache dir and its size limit
+  THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", js_conf.get("THUMBNAIL_WORKERS", 4)))
+  THUMBNAIL_CACHE_DIR = os.getenv("THUMBNAIL_CACHE_DIR", js_conf.get("THUMBNAIL_CACHE_DIR", "/tmp/pipelinegui-thumbnails"))
+  THUMBNAIL_CACHE_MAX_BYTES = int(os.getenv("THUMBNAIL_CACHE_MAX_BYTES", js_conf.get("THUMBNAIL_CACHE_MAX_BYTES", 1024 * 1024 * 1024)))
+
+  # Sidecar files with the error status of the job directories of each sub analysis (see fileutils.get_error_job_paths)
+  ERROR_INDEX_DIR = os.getenv("ERROR_INDEX_DIR", js_conf.get("ERROR_INDEX_DIR", os.path.join(STATIC_CPP_DIR, "error_index")))
+
+  # Fair share weights of the submission scheduler per submitted_by (default 1), a user with weight 2
+  # gets twice the dispatch slots of a user with weight 1 at the same priority (see scheduler.py)
+  _scheduler_user_weights = os.getenv("SCHEDULER_USER_WEIGHTS")
+  SCHEDULER_USER_WEIGHTS = json.loads(_scheduler_user_weights) if _scheduler_user_weights else js_conf.get("SCHEDULER_USER_WEIGHTS", {})
+  if not isinstance(SCHEDULER_USER_WEIGHTS, dict):
+    raise ValueError(f"SCHEDULER_USER_WEIGHTS must be an object of submitted_by -> weight, got {SCHEDULER_USER_WEIGHTS!r}")
+  for _user, _weight in SCHEDULER_USER_WEIGHTS.items():
+    if isinstance(_weight, bool) or not isinstance(_weight, (int, float)) or not 0 < _weight < float("inf"):
+      raise ValueError(f"SCHEDULER_USER_WEIGHTS of {_user!r} must be a positive number, got {_weight!r}")
@@ -0,0 +1,42 @@
+-- Indexes backing the keyset pagination and server side filters of
+-- /api/list/image_analyses and /api/list/image_sub_analyses (see dbqueries.py)
+--
+-- Run against imagedb, e.g.
+--   psql -h imagedb -U postgres -d imagedb -f sql/001_list_filter_indexes.sql
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS image_analyses_pipeline_name_id_idx
+    ON image_analyses (pipeline_name, id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS image_analyses_submitted_by_id_idx
+    ON image_analyses ((meta->>'submitted_by'), id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS image_analyses_plate_acquisition_id_idx
+    ON image_analyses (plate_acquisition_id, id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS image_analyses_start_idx
+    ON image_analyses (start);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS plate_acquisition_plate_barcode_idx
+    ON plate_acquisition (plate_barcode);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS image_sub_analyses_analysis_id_idx
+    ON image_sub_analyses (analysis_id, sub_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS image_sub_analyses_plate_acquisition_id_idx
+    ON image_sub_analyses (plate_acquisition_id, sub_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS image_sub_analyses_start_idx
+    ON image_sub_analyses (start);
+
+-- status=queued/started and status=error are small subsets, partial indexes keep them cheap
+CREATE INDEX CONCURRENTLY IF NOT EXISTS image_sub_analyses_unfinished_idx
+    ON image_sub_analyses (sub_id) WHERE finish IS NULL AND error IS NULL;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS image_sub_analyses_error_idx
+    ON image_sub_analyses (sub_id) WHERE error IS NOT NULL;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS image_analyses_unfinished_idx
+    ON image_analyses (id) WHERE finish IS NULL AND error IS NULL;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS image_analyses_error_idx
+    ON image_analyses (id) WHERE error IS NOT NULL;
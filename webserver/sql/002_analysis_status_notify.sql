@@ -0,0 +1,89 @@
+-- Notifications on the analysis_status channel when an analysis or sub analysis is
+-- added, deleted or its start/finish/error changes, listened to by dbnotify.py
+-- and pushed to the index page (/api/stream/analysis_status).
+--
+-- Payload (json, kept well below the 8000 byte NOTIFY limit):
+--   {"table": ..., "op": "INSERT|UPDATE|DELETE", "id": ..., "analysis_id": ...,
+--    "start": ..., "finish": ..., "error": ...}
+--
+-- Run against imagedb, e.g.
+--   psql -h imagedb -U postgres -d imagedb -f sql/002_analysis_status_notify.sql
+
+CREATE OR REPLACE FUNCTION notify_image_analyses_status() RETURNS trigger AS $$
+DECLARE
+    row_data image_analyses;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        row_data := OLD;
+    ELSE
+        row_data := NEW;
+    END IF;
+
+    PERFORM pg_notify('analysis_status', json_build_object(
+        'table', TG_TABLE_NAME,
+        'op', TG_OP,
+        'id', row_data.id,
+        'analysis_id', row_data.id,
+        'start', row_data.start,
+        'finish', row_data.finish,
+        'error', left(row_data.error, 500)
+    )::text);
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION notify_image_sub_analyses_status() RETURNS trigger AS $$
+DECLARE
+    row_data image_sub_analyses;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        row_data := OLD;
+    ELSE
+        row_data := NEW;
+    END IF;
+
+    PERFORM pg_notify('analysis_status', json_build_object(
+        'table', TG_TABLE_NAME,
+        'op', TG_OP,
+        'id', row_data.sub_id,
+        'analysis_id', row_data.analysis_id,
+        'start', row_data.start,
+        'finish', row_data.finish,
+        'error', left(row_data.error, 500)
+    )::text);
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Updates only notify when one of the status columns changed
+DROP TRIGGER IF EXISTS image_analyses_status_update_notify ON image_analyses;
+CREATE TRIGGER image_analyses_status_update_notify
+    AFTER UPDATE OF start, finish, error ON image_analyses
+    FOR EACH ROW
+    WHEN (OLD.start IS DISTINCT FROM NEW.start
+          OR OLD.finish IS DISTINCT FROM NEW.finish
+          OR OLD.error IS DISTINCT FROM NEW.error)
+    EXECUTE FUNCTION notify_image_analyses_status();
+
+DROP TRIGGER IF EXISTS image_analyses_status_insert_delete_notify ON image_analyses;
+CREATE TRIGGER image_analyses_status_insert_delete_notify
+    AFTER INSERT OR DELETE ON image_analyses
+    FOR EACH ROW
+    EXECUTE FUNCTION notify_image_analyses_status();
+
+DROP TRIGGER IF EXISTS image_sub_analyses_status_update_notify ON image_sub_analyses;
+CREATE TRIGGER image_sub_analyses_status_update_notify
+    AFTER UPDATE OF start, finish, error ON image_sub_analyses
+    FOR EACH ROW
+    WHEN (OLD.start IS DISTINCT FROM NEW.start
+          OR OLD.finish IS DISTINCT FROM NEW.finish
+          OR OLD.error IS DISTINCT FROM NEW.error)
+    EXECUTE FUNCTION notify_image_sub_analyses_status();
+
+DROP TRIGGER IF EXISTS image_sub_analyses_status_insert_delete_notify ON image_sub_analyses;
+CREATE TRIGGER image_sub_analyses_status_insert_delete_notify
+    AFTER INSERT OR DELETE ON image_sub_analyses
+    FOR EACH ROW
+    EXECUTE FUNCTION notify_image_sub_analyses_status();
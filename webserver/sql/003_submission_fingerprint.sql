@@ -0,0 +1,51 @@
+-- Submission fingerprint of image_analyses, used to skip identical submissions
+-- (same plate acquisition, pipeline and pipeline meta, cellprofiler version and filters)
+-- of an analysis that is queued, running or finished, see dbqueries.submit_analyses
+-- and pipeline-monitor/submit_from_csv.py.
+--
+-- The fingerprint is set by a trigger, so analyses inserted by pipeline-monitor get it too.
+-- Analyses that failed (error IS NOT NULL) are not in the index and can be resubmitted.
+--
+-- Run against imagedb, e.g.
+--   psql -h imagedb -U postgres -d imagedb -f sql/003_submission_fingerprint.sql
+
+ALTER TABLE image_analyses ADD COLUMN IF NOT EXISTS submission_fingerprint text;
+
+-- Only the keys of analysis_meta that change the result of an analysis are part of the
+-- fingerprint, priority, submitted_by and where it runs are not
+CREATE OR REPLACE FUNCTION submission_fingerprint(p_plate_acquisition_id integer,
+                                                  p_pipeline_name text,
+                                                  p_analysis_meta jsonb) RETURNS text AS $$
+    SELECT md5(concat_ws('|',
+        p_plate_acquisition_id::text,
+        p_pipeline_name,
+        COALESCE((SELECT md5(p.meta::jsonb::text) FROM analysis_pipelines p WHERE p.name = p_pipeline_name), ''),
+        COALESCE(p_analysis_meta->>'cp_version', ''),
+        COALESCE((SELECT string_agg(trim(f), ',' ORDER BY trim(f))
+                  FROM jsonb_array_elements_text(COALESCE(p_analysis_meta->'well_filter', '[]')) AS f), ''),
+        COALESCE((SELECT string_agg(trim(f), ',' ORDER BY trim(f))
+                  FROM jsonb_array_elements_text(COALESCE(p_analysis_meta->'site_filter', '[]')) AS f), ''),
+        COALESCE(trim(p_analysis_meta->>'z'), '')
+    ))
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION set_submission_fingerprint() RETURNS trigger AS $$
+BEGIN
+    NEW.submission_fingerprint := submission_fingerprint(NEW.plate_acquisition_id, NEW.pipeline_name, NEW.meta::jsonb);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS image_analyses_set_submission_fingerprint ON image_analyses;
+CREATE TRIGGER image_analyses_set_submission_fingerprint
+    BEFORE INSERT ON image_analyses
+    FOR EACH ROW
+    EXECUTE FUNCTION set_submission_fingerprint();
+
+-- Existing analyses, fingerprinted with the current meta of their pipeline
+UPDATE image_analyses
+   SET submission_fingerprint = submission_fingerprint(plate_acquisition_id, pipeline_name, meta::jsonb)
+ WHERE submission_fingerprint IS NULL;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS image_analyses_submission_fingerprint_idx
+    ON image_analyses (submission_fingerprint) WHERE error IS NULL;
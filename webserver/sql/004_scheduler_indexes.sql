@@ -0,0 +1,15 @@
+-- Indexes of the submission scheduler (scheduler.py, dbqueries.select_scheduler_state),
+-- which reads all queued and all started sub analyses on every /api/scheduler/order request.
+--
+-- Run against imagedb, e.g.
+--   psql -h imagedb -U postgres -d imagedb -f sql/004_scheduler_indexes.sql
+
+-- queued sub analyses, the candidates for dispatch
+CREATE INDEX CONCURRENTLY IF NOT EXISTS image_sub_analyses_queued_idx
+    ON image_sub_analyses (sub_id) INCLUDE (analysis_id, priority)
+    WHERE start IS NULL AND finish IS NULL AND error IS NULL;
+
+-- started sub analyses, counted per user for the fair share
+CREATE INDEX CONCURRENTLY IF NOT EXISTS image_sub_analyses_started_idx
+    ON image_sub_analyses (analysis_id)
+    WHERE start IS NOT NULL AND finish IS NULL AND error IS NULL;
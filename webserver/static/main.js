@@ -10,6 +10,12 @@
         this.options = options;
         // Assign a default limit of 1000 if not specified in options
         this.limit = options.limit !== undefined ? options.limit : 1000;
+        // Cursor for the next (older) page, set by endpoints that support keyset pagination
+        this.nextCursor = null;
+        // Names of server side filters that are taken from the page url, e.g. index.html?submitted_by=anders
+        this.serverFilters = options.serverFilters || [];
+        // Column with the row id, kept as row._id before transformations turn it into links (see patchRow)
+        this.keyColumn = options.keyColumn || null;
         this.init();
     }
 
@@ -18,9 +24,16 @@
         this.setupOptionalFilterListener();
     }
 
-    fetchAndDrawTable() {
+    fetchAndDrawTable(loadMore = false) {
         // Construct API URL based on whether limit is defined
         let apiUrl = this.limit ? `${this.apiEndpoint}/${this.limit}` : this.apiEndpoint;
+        let params = this.getServerParams();
+        if (loadMore && this.nextCursor !== null) {
+          params.set('before_id', this.nextCursor);
+        }
+        if (params.toString()) {
+          apiUrl += '?' + params.toString();
+        }
 
         fetch(apiUrl)
             .then(response => {
@@ -31,11 +44,17 @@
             })
             .then(json => {
                 const data = json && json['result'];
-                this.rows = Array.isArray(data) ? data : [];
-                this.pre_transformations_hook();
-                // Only apply transformations when there is at least a header row
-                if (this.rows.length > 0) {
-                  this.applyTransformations(); // Apply transformations (can be overridden by subclasses)
+                this.nextCursor = (json && json['next_cursor'] !== undefined) ? json['next_cursor'] : null;
+                if (loadMore) {
+                  this.appendRows(Array.isArray(data) ? data : []);
+                } else {
+                  this.rows = Array.isArray(data) ? data : [];
+                  this.setRowKeys(this.rows);
+                  this.pre_transformations_hook();
+                  // Only apply transformations when there is at least a header row
+                  if (this.rows.length > 0) {
+                    this.applyTransformations(); // Apply transformations (can be overridden by subclasses)
+                  }
                 }
                 this.drawTable();
             })
@@ -45,6 +64,59 @@
             });
     }
 
+    getServerParams() {
+      let params = new URLSearchParams();
+      let pageParams = new URLSearchParams(window.location.search);
+      for (let name of this.serverFilters) {
+        if (pageParams.get(name)) {
+          params.set(name, pageParams.get(name));
+        }
+      }
+      return params;
+    }
+
+    appendRows(pageRows) {
+      // Transform the new page on its own (transformations work on this.rows incl. header), then append its data rows
+      if (pageRows.length < 2) return;
+      this.setRowKeys(pageRows);
+      let existingRows = this.rows;
+      this.rows = pageRows;
+      this.applyTransformations();
+      let transformedRows = this.rows;
+      this.rows = existingRows.length > 0 ? existingRows.concat(transformedRows.slice(1)) : transformedRows;
+    }
+
+    setRowKeys(rows) {
+      if (!this.keyColumn || rows.length === 0) return;
+      let keyIndex = rows[0].indexOf(this.keyColumn);
+      if (keyIndex === -1) return;
+      for (let nRow = 1; nRow < rows.length; nRow++) {
+        rows[nRow]._id = rows[nRow][keyIndex];
+      }
+    }
+
+    patchRow(id, values) {
+      // Update the cells of one row in place, returns false if the row is not loaded
+      let row = this.rows.find((row, index) => index > 0 && row._id === id);
+      if (!row) return false;
+      let cols = this.rows[0];
+      for (let [column, value] of Object.entries(values)) {
+        let colIndex = cols.indexOf(column);
+        if (colIndex !== -1) {
+          row[colIndex] = value;
+        }
+      }
+      this.drawTable();
+      return true;
+    }
+
+    removeRow(id) {
+      let rowIndex = this.rows.findIndex((row, index) => index > 0 && row._id === id);
+      if (rowIndex === -1) return;
+      this.rows.splice(rowIndex, 1);
+      this.drawTable();
+    }
+
     setupOptionalFilterListener() {
       // Only proceed if filterElementId is specified in options
       if (this.options.filterElementId) {
@@ -145,6 +217,16 @@
       }
 
       container.appendChild(table);
+
+      // More rows available on server
+      if (this.nextCursor !== null) {
+        let loadMoreButton = document.createElement('button');
+        loadMoreButton.type = 'button';
+        loadMoreButton.className = 'btn btn-sm btn-outline-secondary mb-3';
+        loadMoreButton.textContent = 'Load more';
+        loadMoreButton.addEventListener('click', () => this.fetchAndDrawTable(true));
+        container.appendChild(loadMoreButton);
+      }
       console.log("Table drawn successfully");
     }
 
@@ -329,8 +411,81 @@ class ImageAnalysisTable extends DataTable {
         this.rows = this.addSegmentationLinkColumn(this.rows);
         this.rows = this.addGoToSubLinkColumn(this.rows);
         this.rows = this.truncateColumn(this.rows, "result", 100);
+        this.rows = this.addProgressColumn(this.rows);
+
+
+  }
+
+  pre_transformations_hook(){
+    // Progress of the loaded analyses, filled into the progress column when it arrives
+    this.progress = {};
+    this.fetchProgress(this.rows);
+  }
+
+  appendRows(pageRows) {
+    super.appendRows(pageRows);
+    this.fetchProgress(pageRows);
+  }
+
+  drawTable() {
+    super.drawTable();
+    this.drawProgress();
+  }
+
+  addProgressColumn(rows) {
+    if (!rows || rows.length === 0) return rows || [];
+    if (!Array.isArray(rows[0])) return rows;
+    rows[0].push("progress");
+    for (let nRow = 1; nRow < rows.length; nRow++) {
+      rows[nRow].push(`<div class='analysis-progress' data-analysis-id='${rows[nRow]._id}'></div>`);
+    }
+    return rows;
+  }
 
+  fetchProgress(rows) {
+    let ids = rows.slice(1).map(row => row._id).filter(id => id !== undefined);
+    if (ids.length === 0) return;
 
+    fetch('/api/analysis/progress?ids=' + ids.join(','))
+      .then(response => response.ok ? response.json() : null)
+      .then(json => {
+        if (!json) return;
+        for (let progress of json['result']) {
+          this.progress[progress['analysis_id']] = progress;
+        }
+        this.drawProgress();
+      })
+      .catch(error => console.log(error));
+  }
+
+  refreshProgress() {
+    // Sub analyses changed state, update the bars once for a burst of changes
+    clearTimeout(this.progressTimer);
+    this.progressTimer = setTimeout(() => {
+      this.fetchProgress(this.rows);
+    }, 2000);
+  }
+
+  drawProgress() {
+    let container = document.getElementById(this.options.tableDivId);
+    for (let elem of container.querySelectorAll('.analysis-progress')) {
+      let progress = this.progress && this.progress[elem.dataset.analysisId];
+      if (!progress || progress['total'] === 0) continue;
+      let percent = (n) => (100 * n / progress['total']).toFixed(1);
+      let remaining = progress['estimated_remaining_seconds'];
+      let title = `queued: ${progress['queued']}, started: ${progress['started']}, ` +
+                  `finished: ${progress['finished']}, error: ${progress['error']}`;
+      if (remaining) {
+        title += `, estimated remaining: ${Math.round(remaining / 60)} min`;
+      }
+      elem.title = title;
+      elem.innerHTML =
+        `<div class='progress' style='min-width: 80px;'>` +
+        `<div class='progress-bar bg-success' style='width: ${percent(progress['finished'])}%'></div>` +
+        `<div class='progress-bar progress-bar-striped' style='width: ${percent(progress['started'])}%'></div>` +
+        `<div class='progress-bar bg-danger' style='width: ${percent(progress['error'])}%'></div>` +
+        `</div>${progress['finished']}/${progress['total']}`;
+    }
   }
 
   addControlsColumn(rows) {
@@ -464,13 +619,6 @@ class JobsTable extends DataTable {
     super('/api/list/jobs', options);
   }
 
-  pre_transformations_hook(){
-    // Only draw stats if rows exist
-    if (Array.isArray(this.rows) && this.rows.length > 0) {
-      this.drawJobStats();
-    }
-  }
-
   applyTransformations(){
     this.addShowLogColumn()
   }
@@ -513,36 +661,29 @@ class JobsTable extends DataTable {
       }
     }
   }
+}
 
-  drawJobStats() {
-    // Calculate stats by looping rows
-    if (!Array.isArray(this.rows) || this.rows.length === 0) return;
-    let cols = this.rows[0];
-    if (!Array.isArray(cols)) return;
-    let active_col_index = cols.indexOf("ACTIVE");
-    let succeeded_col_index = cols.indexOf("SUCCEEDED");
-    let failed_col_index = cols.indexOf("FAILED");
-    if (active_col_index === -1 || succeeded_col_index === -1 || failed_col_index === -1) return;
-
-    let active = 0;
-    let succeeded = 0;
-    let failed = 0;
-
-    for (let nRow = 1; nRow < this.rows.length; nRow++) {
-      active +=  parseInt(this.rows[nRow][active_col_index]);
-      succeeded +=  parseInt(this.rows[nRow][succeeded_col_index]);
-      failed +=  parseInt(this.rows[nRow][failed_col_index]);
-    }
+// Job counts are computed by the server (/api/stats/jobs), small enough to poll
+const JOB_STATS_POLL_MS = 5000;
 
-    let total = this.rows.length -1; // -1 because of Header row
-    let queued = total - active - succeeded - failed;
+function drawJobStatsCounts(counts) {
+  document.getElementById("n_total_jobs").textContent = counts['total'];
+  document.getElementById("n_active_jobs").textContent = counts['active'];
+  document.getElementById("n_succeeded_jobs").textContent = counts['succeeded'];
+  document.getElementById("n_queued_jobs").textContent = counts['queued'];
+  document.getElementById("n_failed_jobs").textContent = counts['failed'];
+}
 
-    document.getElementById("n_total_jobs").textContent = total;
-    document.getElementById("n_active_jobs").textContent = active;
-    document.getElementById("n_succeeded_jobs").textContent = succeeded;
-    document.getElementById("n_queued_jobs").textContent = queued;
-    document.getElementById("n_failed_jobs").textContent = failed;
-  }
+function pollJobStats() {
+  fetch('/api/stats/jobs')
+    .then(response => response.ok ? response.json() : null)
+    .then(json => {
+      if (json) {
+        drawJobStatsCounts(json['result']['jobs']);
+      }
+    })
+    .catch(error => console.log(error))
+    .finally(() => setTimeout(pollJobStats, JOB_STATS_POLL_MS));
 }
 
 class PipelineFilesTable extends DataTable {
@@ -1307,7 +1448,8 @@ function getAnalysisPipelineFromName(name){
 
 function viewJobLog(jobName){
 
-  apiGetJobLog(jobName);
+  // The log page streams the log of the selected pod of the job
+  window.open('/joblog/' + jobName, 'joblog');
 
 }
 
@@ -1330,17 +1472,58 @@ function apiLoadAnalysisPipelines(selected = "") {
     })
 }
 
+const PLATE_ACQ_CACHE_KEY = 'pipelinegui-plate_acquisitions';
+// since_id only fetches new acquisitions, renamed or deleted ones show up after a full reload
+const PLATE_ACQ_CACHE_TTL_MS = 60 * 60 * 1000;
+
+function loadPlateAcqCache() {
+  try {
+    let cache = JSON.parse(window.localStorage.getItem(PLATE_ACQ_CACHE_KEY));
+    if (cache && Array.isArray(cache.rows) && cache.rows.length > 1 &&
+        Date.now() - (cache.fullLoadTime || 0) < PLATE_ACQ_CACHE_TTL_MS) {
+      return cache;
+    }
+  } catch (error) {
+    console.log('Ignoring invalid plate_acquisition cache', error);
+  }
+  return null;
+}
+
+function mergePlateAcqRows(cachedRows, newRows, limit) {
+  // Both tables are [header, ...rows] sorted newest first, new rows go on top
+  if (!cachedRows || newRows.length > 0 && JSON.stringify(cachedRows[0]) !== JSON.stringify(newRows[0])) {
+    return newRows.slice(0, limit + 1);
+  }
+  return [cachedRows[0]].concat(newRows.slice(1), cachedRows.slice(1)).slice(0, limit + 1);
+}
+
 function apiLoadPlateAcqSelect(selected = "") {
 
   let limit = 500;
 
-  fetch('/api/list/plate_acquisition/' + limit )
+  // Only fetch acquisitions newer than the ones already cached in the browser
+  let cache = loadPlateAcqCache();
+  let url = '/api/list/plate_acquisition/' + limit;
+  if (cache) {
+    url += '?since_id=' + encodeURIComponent(cache.latestId);
+  }
+
+  fetch(url)
     .then(response => response.json())
     .then(data => {
 
       console.log('plate_acquisition data', data);
 
-      updatePlateAcqSelect(data.result, selected);
+      let rows = mergePlateAcqRows(cache ? cache.rows : null, data.result, limit);
+      let idColIndex = rows[0].indexOf('id');
+      if (idColIndex !== -1 && rows.length > 1) {
+        let fullLoadTime = cache ? cache.fullLoadTime : Date.now();
+        window.localStorage.setItem(PLATE_ACQ_CACHE_KEY, JSON.stringify({latestId: rows[1][idColIndex], rows: rows, fullLoadTime: fullLoadTime}));
+      } else {
+        window.localStorage.removeItem(PLATE_ACQ_CACHE_KEY);
+      }
+
+      updatePlateAcqSelect(rows, selected);
 
     })
     .catch(error => {
@@ -1759,7 +1942,17 @@ function apiRunAnalysis() {
         response.json().then(function (json) {
 
           $("#run-analysis-modal").modal('hide');
-          showOKModal("Analysis submitted OK");
+
+          // plates with an identical analysis already queued, running or finished are skipped
+          let duplicates = json['analyses'].filter(analysis => analysis['duplicate_of']);
+          if (duplicates.length > 0) {
+            let message = `Skipped ${duplicates.length} of ${json['analyses'].length} plates, identical analyses already exist:<br>`;
+            message += duplicates.map(analysis => `PlateAcqID ${analysis['plate_acquisition']}: analysis ${analysis['duplicate_of']}`).join('<br>');
+            message += "<br><br>Check \"Allow duplicates\" to submit them anyway.";
+            displayModalMessage(message);
+          } else {
+            showOKModal("Analysis submitted OK");
+          }
         });
       }
       else {
@@ -1775,6 +1968,9 @@ function apiRunAnalysis() {
     });
 }
 
+// Last generated imgset csv and its ETag, reused when the server answers 304 Not Modified
+let lastImgset = null;
+
 function apiGenerateImgset(){
 
   // delete current content in textarea
@@ -1792,14 +1988,27 @@ function apiGenerateImgset(){
 
   console.log("form data", formData);
 
+  let headers = {};
+  if (lastImgset) {
+    headers['If-None-Match'] = lastImgset.etag;
+  }
+
   fetch('/api/imgset/save', {
     method: 'POST',
+    headers: headers,
     body: formData
     })
     .then(function (response) {
-      if (response.status === 200) {
+      if (response.status === 304) {
+        document.getElementById('imgset-textarea').value = lastImgset.text;
+        $("#save-imgset-modal").modal('hide');
+      }
+      else if (response.status === 200) {
         response.text().then(function (text) {
 
+          let etag = response.headers.get('Etag');
+          lastImgset = etag ? {etag: etag, text: text} : null;
+
           document.getElementById('imgset-textarea').value = text;
 
           $("#save-imgset-modal").modal('hide');
@@ -2006,24 +2215,84 @@ function saveImgsetAsLocalFile() {
     downloadLink.click();
 }
 
+function listenAnalysisStatus(tables) {
+  // Status changes pushed by the server (Postgres NOTIFY), patched into the loaded rows
+  let eventSource = new EventSource('/api/stream/analysis_status');
+  let reloadTimers = {};
+
+  function reloadLater(table) {
+    // New rows (or missed events) need the full row, reload once for a burst of events
+    clearTimeout(reloadTimers[table.options.tableDivId]);
+    reloadTimers[table.options.tableDivId] = setTimeout(() => table.fetchAndDrawTable(), 2000);
+  }
+
+  eventSource.addEventListener('status', function (event) {
+    let change = JSON.parse(event.data);
+    let table = tables[change['table']];
+    if (!table) return;
+    if (change['op'] === 'DELETE') {
+      table.removeRow(change['id']);
+    } else if (change['op'] === 'INSERT') {
+      reloadLater(table);
+    } else {
+      let values = {'start': change['start'], 'finish': change['finish'], 'error': change['error']};
+      if (!table.patchRow(change['id'], values)) {
+        // row not loaded (other page or filtered on the server), nothing to patch
+        console.log('status change of row not loaded', change);
+      }
+    }
+    if (change['table'] === 'image_sub_analyses' && tables['image_analyses']) {
+      tables['image_analyses'].refreshProgress();
+    }
+  });
+
+  function reloadAll() {
+    for (let table of Object.values(tables)) {
+      reloadLater(table);
+    }
+  }
+
+  eventSource.addEventListener('resync', reloadAll);
+
+  // EventSource reconnects by itself, events sent while disconnected are lost
+  let connectedBefore = false;
+  eventSource.onopen = function () {
+    if (connectedBefore) {
+      reloadAll();
+    }
+    connectedBefore = true;
+  };
+}
+
 function initIndexPage() {
   console.log("Inside initIndexPage()");
 
-  new ImageAnalysisTable({
+  // Server side filters can be given in the page url, e.g. index.html?status=error&submitted_by=anders
+  const serverFilters = ['plate_barcode', 'pipeline_name', 'status', 'submitted_by', 'date_from', 'date_to'];
+
+  let analysesTable = new ImageAnalysisTable({
     tableDivId: 'image_analyses-table-div',
-    filterElementId: 'filter-input' // Only if you have a filter input element
+    filterElementId: 'filter-input', // Only if you have a filter input element
+    serverFilters: serverFilters,
+    keyColumn: 'id'
   });
 
-  new ImageSubAnalysisTable({
+  let subAnalysesTable = new ImageSubAnalysisTable({
     tableDivId: 'image_sub_analyses-table-div',
-    filterElementId: 'filter-input' // Only if you have a filter input element
+    filterElementId: 'filter-input', // Only if you have a filter input element
+    serverFilters: serverFilters,
+    keyColumn: 'sub_id'
   });
 
+  listenAnalysisStatus({'image_analyses': analysesTable, 'image_sub_analyses': subAnalysesTable});
+
   new JobsTable({
     tableDivId: 'jobs-table-div',
     limit: null
   });
 
+  pollJobStats();
+
 }
 
 function initCreateAnalysisPage() {
@@ -0,0 +1,8 @@
+import os
+import sys
+
+WEBSERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, WEBSERVER_DIR)
+# settings reads its conf file relative to the working directory
+os.environ.setdefault("CONF_FILE", os.path.join(WEBSERVER_DIR, "settings_dev_local.json"))
@@ -0,0 +1,36 @@
+import datetime
+import decimal
+import json
+import uuid
+
+import jsonutils
+
+
+def test_numeric_column_keeps_its_precision():
+    row = {'id': 1, 'progress': decimal.Decimal('0.1000000000000000055511151231257827')}
+
+    assert json.loads(jsonutils.dumps(row)) == {'id': 1, 'progress': '0.1000000000000000055511151231257827'}
+
+
+def test_uuid_and_dates():
+    row = {'job_uid': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+           'start': datetime.datetime(2024, 1, 31, 12, 30),
+           'day': datetime.date(2024, 1, 31),
+           'duration': datetime.timedelta(hours=1, minutes=2)}
+
+    assert json.loads(jsonutils.dumps(row)) == {'job_uid': '12345678-1234-5678-1234-567812345678',
+                                                'start': '2024-01-31T12:30:00',
+                                                'day': '2024-01-31',
+                                                'duration': '1:02:00'}
+
+
+def test_other_types_fall_back_to_str():
+    class Range:
+        def __str__(self):
+            return '[1,5)'
+
+    assert jsonutils.dumps([Range()]) == '["[1,5)"]'
+
+
+def test_compact_output():
+    assert jsonutils.dumps({'a': [1, 2]}) == '{"a":[1,2]}'
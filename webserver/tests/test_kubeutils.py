@@ -0,0 +1,81 @@
+import types
+
+import pytest
+
+pytest.importorskip("kubernetes")
+
+import kubeutils
+import settings as pipelinegui_settings
+
+
+def make_job(name, resource_version, analysis_id="1"):
+    metadata = types.SimpleNamespace(name=name, labels={'analysis_id': analysis_id},
+                                     creation_timestamp=None, resource_version=resource_version)
+    return types.SimpleNamespace(metadata=metadata, status=None)
+
+
+class FakeBatchApi:
+
+    def __init__(self, listings):
+        self.listings = list(listings)
+        self.list_calls = []
+
+    def list_namespaced_job(self, namespace, **kwargs):
+        self.list_calls.append(kwargs)
+        jobs, resource_version = self.listings.pop(0)
+        metadata = types.SimpleNamespace(_continue=None, resource_version=resource_version)
+        return types.SimpleNamespace(items=jobs, metadata=metadata)
+
+
+class FakeWatch:
+    """
+    Each Watch yields the next list of events from streams, the cache is stopped when they run out
+    """
+
+    def __init__(self, cache, streams):
+        self.cache = cache
+        self.streams = streams
+        self.stream_calls = []
+
+    def __call__(self):
+        return self
+
+    def stream(self, func, **kwargs):
+        self.stream_calls.append(kwargs)
+        if not self.streams:
+            self.cache.stop()
+            return
+        yield from self.streams.pop(0)
+
+    def stop(self):
+        pass
+
+
+def test_watch_error_410_relists_jobs():
+    batch_api = FakeBatchApi([([make_job("job-a", "10")], "10"),
+                              ([make_job("job-a", "20"), make_job("job-b", "20")], "20")])
+    cache = kubeutils.JobCache("ns", batch_api=batch_api, watch_timeout=60)
+    gone = {'type': 'ERROR', 'object': None, 'raw_object': {'code': 410, 'reason': 'Expired'}}
+    watch = FakeWatch(cache, [[gone]])
+    cache.watch_factory = watch
+
+    cache._run()
+
+    assert len(batch_api.list_calls) == 2
+    assert cache.resource_version == "20"
+    assert sorted(job['name'] for job in cache.get_jobs()) == ["job-a", "job-b"]
+    # the first watch started from the first listing, the one after the 410 from the relisting
+    assert [call['resource_version'] for call in watch.stream_calls] == ["10", "20"]
+
+
+def test_watch_has_a_read_timeout():
+    batch_api = FakeBatchApi([([], "10")])
+    cache = kubeutils.JobCache("ns", batch_api=batch_api, watch_timeout=60)
+    watch = FakeWatch(cache, [])
+    cache.watch_factory = watch
+
+    cache._run()
+
+    connect_timeout, read_timeout = watch.stream_calls[0]['_request_timeout']
+    assert connect_timeout == pipelinegui_settings.K8S_REQUEST_TIMEOUT
+    assert read_timeout > 60
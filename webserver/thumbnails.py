@@ -0,0 +1,142 @@
+"""
+Downsampled JPEG/WebP previews of the result images, generated in a process pool and kept in a
+size bounded disk cache (least recently used thumbnails are removed first).
+"""
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+import settings as pipelinegui_settings
+
+FORMATS = {'jpeg': 'image/jpeg', 'webp': 'image/webp'}
+MIN_WIDTH = 32
+MAX_WIDTH = 2048
+
+_process_pool = None
+_in_progress = {}
+_cache_size = None
+_cache_lock = threading.Lock()
+
+
+def get_process_pool():
+    # image decoding is CPU bound, a process pool keeps it off the IOLoop and out of the GIL.
+    # The workers are spawned, a fork of the server would copy its threads' locks (DB pool,
+    # file index, job cache) in whatever state they are and can deadlock
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=pipelinegui_settings.THUMBNAIL_WORKERS,
+                                            mp_context=multiprocessing.get_context('spawn'))
+    return _process_pool
+
+
+def get_thumbnail_path(image_path, width, fmt):
+    """
+    Cache path of a thumbnail, the name covers the mtime and size of the image so a changed
+    image gets a new thumbnail. Returns (path, key), key can be used as ETag.
+    """
+    stat = os.stat(image_path)
+    key = hashlib.sha1(f"{image_path}|{stat.st_mtime}|{stat.st_size}|{width}|{fmt}".encode()).hexdigest()
+    return os.path.join(pipelinegui_settings.THUMBNAIL_CACHE_DIR, f"{key}.{fmt}"), key
+
+
+def make_thumbnail(image_path, thumbnail_path, width, fmt):
+    """
+    Runs in the process pool: downsample image_path to width (keeping the aspect ratio) and write thumbnail_path
+    """
+    with Image.open(image_path) as image:
+        # lets JPEG decoders skip most of the full resolution decoding
+        image.draft('RGB', (width, width * image.height // max(image.width, 1)))
+
+        if image.mode in ('I;16', 'I;16B', 'I;16L', 'I', 'F'):
+            # 16 bit microscopy images, stretch the used intensity range to 8 bit
+            image = image.convert('F')
+            low, high = image.getextrema()
+            scale = 255.0 / (high - low) if high > low else 1.0
+            image = image.point(lambda value: (value - low) * scale).convert('L')
+        elif image.mode not in ('L', 'RGB'):
+            image = image.convert('RGB')
+
+        image.thumbnail((width, image.height), Image.LANCZOS)
+
+        tmp_path = f"{thumbnail_path}.{os.getpid()}.tmp"
+        image.save(tmp_path, format=fmt.upper(), quality=85)
+        os.replace(tmp_path, thumbnail_path)
+
+    return os.path.getsize(thumbnail_path)
+
+
+async def get_thumbnail(image_path, thumbnail_path, width, fmt, executor):
+    """
+    Make sure the thumbnail at thumbnail_path (see get_thumbnail_path) exists, generated in the
+    process pool if it is not cached. Concurrent requests for the same thumbnail wait for the same
+    generation, only the request that started it adds it to the cache size.
+    """
+    loop = asyncio.get_running_loop()
+    if await loop.run_in_executor(executor, touch, thumbnail_path):
+        return thumbnail_path
+
+    future = _in_progress.get(thumbnail_path)
+    if future is not None:
+        await future
+        return thumbnail_path
+
+    os.makedirs(pipelinegui_settings.THUMBNAIL_CACHE_DIR, exist_ok=True)
+    future = loop.run_in_executor(get_process_pool(), make_thumbnail, image_path, thumbnail_path, width, fmt)
+    _in_progress[thumbnail_path] = future
+    future.add_done_callback(lambda _: _in_progress.pop(thumbnail_path, None))
+
+    size = await future
+    await loop.run_in_executor(executor, add_to_cache, size)
+    return thumbnail_path
+
+
+def touch(thumbnail_path):
+    # mtime is the last use of a thumbnail (atime is often not updated), returns False if not cached
+    try:
+        os.utime(thumbnail_path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def add_to_cache(size):
+    global _cache_size
+    with _cache_lock:
+        if _cache_size is None:
+            _cache_size = sum(entry.stat().st_size for entry in os.scandir(pipelinegui_settings.THUMBNAIL_CACHE_DIR))
+        else:
+            _cache_size += size
+
+        if _cache_size > pipelinegui_settings.THUMBNAIL_CACHE_MAX_BYTES:
+            _cache_size = evict(pipelinegui_settings.THUMBNAIL_CACHE_DIR,
+                                int(pipelinegui_settings.THUMBNAIL_CACHE_MAX_BYTES * 0.9))
+
+
+def evict(cache_dir, target_bytes):
+    """
+    Remove the least recently used thumbnails until the cache is below target_bytes, returns the new size
+    """
+    entries = []
+    with os.scandir(cache_dir) as dir_entries:
+        for entry in dir_entries:
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for mtime, size, path in entries)
+    for mtime, size, path in sorted(entries):
+        if total <= target_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except FileNotFoundError:
+            pass
+
+    logging.info(f"Thumbnail cache evicted down to {total} bytes")
+    return total